@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Compare the old load-everything Grafana response parsing with the streaming decoder in checker/frames.py
+on a synthetic response. Reports wall time and peak Python memory for each.
+
+    python3 benchmarks/bench_frames.py --series 50 --points 5760
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from checker import frames  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Benchmark the Grafana frame decoder.')
+parser.add_argument('--series', type=int, default=50, help='Number of frames (worker series) in the response.')
+parser.add_argument('--points', type=int, default=5760, help='Points per series. 5760 is 24h at 15s.')
+parser.add_argument('--null-ratio', type=float, default=0.05, help='Fraction of null samples.')
+parser.add_argument('--quantiles', action='store_true', help='Also estimate p50/p95 while streaming.')
+args = parser.parse_args()
+
+
+def write_response(path):
+    random.seed(0)
+    start = 1700000000000
+    with open(path, 'w') as f:
+        f.write('{"results": {"A": {"status": 200, "frames": [')
+        for i in range(args.series):
+            if i:
+                f.write(',')
+            times = [start + x * 15000 for x in range(args.points)]
+            values = [None if random.random() < args.null_ratio else random.uniform(0, 0.004) for _ in range(args.points)]
+            json.dump({
+                'schema': {'name': f'{{job="synapse", index="{i}"}}', 'fields': [{'name': 'Time'}, {'name': 'Value', 'labels': {'job': 'synapse', 'index': str(i)}}]},
+                'data': {'values': [times, values]},
+            }, f)
+        f.write(']}}}')
+
+
+def old_parse(path):
+    # What parse_avg_python_gc_time() used to do, minus numpy.
+    with open(path) as f:
+        response = json.load(f)
+    good = []
+    for i in response['results']['A']['frames']:
+        new = []
+        for x in range(len(i['data']['values'][1])):
+            if i['data']['values'][1][x] is not None:
+                new.append(i['data']['values'][1][x])
+        good.append(new)
+    return [round(sum(x) / len(x), 5) for x in good if len(x) > 0]
+
+
+def new_parse(path):
+    with open(path, 'rb') as f:
+        results = frames.decode_grafana(f, quantiles=(0.5, 0.95) if args.quantiles else ())
+    return [round(i['stats'].mean, 5) for i in results['A'] if i['stats'].count > 0]
+
+
+def measure(func, path):
+    # Timed without tracemalloc since tracing slows allocations down a lot.
+    start = time.perf_counter()
+    result = func(path)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func(path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        write_response(path)
+        print(f'response: {args.series} series x {args.points} points, {round(os.path.getsize(path) / 1024 / 1024, 1)} MiB')
+        print(f'ijson: {"yes, backend " + frames.ijson.backend if frames.ijson else "not installed, falling back to json.load()"}')
+        old_result, old_time, old_peak = measure(old_parse, path)
+        new_result, new_time, new_peak = measure(new_parse, path)
+        print(f'{"":<10}{"time (s)":>12}{"peak mem (MiB)":>18}')
+        print(f'{"old":<10}{old_time:>12.3f}{old_peak / 1024 / 1024:>18.2f}')
+        print(f'{"streaming":<10}{new_time:>12.3f}{new_peak / 1024 / 1024:>18.2f}')
+        if old_result != new_result:
+            print('MISMATCH: the decoders returned different averages.')
+            sys.exit(1)
+        print('results match.')
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Measure how long a notification takes to send, with the old login() + send_msg() path (two event loops, a join every time)
+and with synapse_client.notify() (one event loop and connection, joins only rooms it isn't in yet).
+Each run is what one notification script does, the messages really get sent so use a test room.
+
+    python3 benchmarks/bench_notify.py --user @bot:example.com --pw ... --hs https://matrix.example.com --room '!test:example.com' --runs 10
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import checker.synapse_client as synapse_client  # noqa: E402
+from checker.notify import build_content, build_msg  # noqa: E402
+from checker.probe import percentile  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Benchmark sending a notification.')
+parser.add_argument('--user', required=True, help='User ID for the bot.')
+parser.add_argument('--pw', required=True, help='Password for the bot.')
+parser.add_argument('--hs', required=True, help='Homeserver of the bot.')
+parser.add_argument('--room', required=True, help='Room to send the test messages to.')
+parser.add_argument('--auth-file', help="File to cache the bot's login details to.")
+parser.add_argument('--runs', type=int, default=10, help='Messages to send with each path.')
+args = parser.parse_args()
+
+
+def legacy(output):
+    access_token, client = synapse_client.login(args.user, args.pw, args.hs, args.auth_file, args.room)
+    synapse_client.send_msg(client, args.room, build_msg('bench', 'bench_notify.py', 'OK', time.ctime(), output))
+
+
+def oneshot(output):
+    synapse_client.notify(args.user, args.pw, args.hs, args.auth_file, args.room, build_content('bench', 'bench_notify.py', 'OK', time.ctime(), output))
+
+
+def main():
+    # Log in once first so both paths start with a cached token.
+    oneshot('warmup')
+    for name, send in (('login() + send_msg()', legacy), ('notify()', oneshot)):
+        times = []
+        for i in range(args.runs):
+            start = time.perf_counter()
+            send(f'{name} {i + 1}/{args.runs}')
+            times.append(time.perf_counter() - start)
+        times.sort()
+        print(f'{name}: min {times[0] * 1000:.0f} ms, median {statistics.median(times) * 1000:.0f} ms, p95 {percentile(times, 0.95) * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
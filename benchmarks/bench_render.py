@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Compare rendering a notification with build_content() against markdown.markdown(build_msg()), and what importing each costs.
+
+    python3 benchmarks/bench_render.py --number 10000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import timeit
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, REPO)
+
+from checker.notify import build_content, build_msg  # noqa: E402
+
+parser = argparse.ArgumentParser(description='Benchmark rendering notification messages.')
+parser.add_argument('--number', type=int, default=5000, help='Messages to render per measurement.')
+parser.add_argument('--runs', type=int, default=5, help='Measurements (and cold imports) per variant, the fastest one is reported.')
+args = parser.parse_args()
+
+ARGS = ('web01', 'Web 01', 'CRITICAL', 'Mon Jan 1 10:00:00 UTC 2024', 'DISK CRITICAL - free space: / 812 MB (2% inode=91%)\n/boot 100 MB',
+        'disk', 'Disk /', '10.0.0.1', 'Looking into it', 'admin', 'https://icinga.example.com')
+
+
+def import_time(module):
+    times = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import {module}'], cwd=REPO, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    import markdown
+    variants = (('markdown.markdown(build_msg())', lambda: markdown.markdown(build_msg(*ARGS))), ('build_content()', lambda: build_content(*ARGS)))
+    for name, render in variants:
+        seconds = min(timeit.repeat(render, number=args.number, repeat=args.runs)) / args.number
+        print(f'{name}: {seconds * 1e6:.1f} us per message')
+
+    baseline = import_time('sys')
+    for module in ('markdown', 'checker.notify'):
+        print(f'import {module}: {(import_time(module) - baseline) * 1000:.1f} ms over a bare interpreter')
+
+
+if __name__ == '__main__':
+    main()
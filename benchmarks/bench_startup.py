@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Measure the cold-start time of every entry point and where its import time goes (python -X importtime).
+Each script is run with --help so it stops right after its imports and argument parsing.
+
+    python3 benchmarks/bench_startup.py --runs 10
+    python3 benchmarks/bench_startup.py --save before.json
+    python3 benchmarks/bench_startup.py --compare before.json
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+parser = argparse.ArgumentParser(description='Benchmark the startup time of the checks and notification scripts.')
+parser.add_argument('scripts', nargs='*', help='Scripts to measure. Defaults to every script in the repo.')
+parser.add_argument('--runs', type=int, default=5, help='Cold starts per script.')
+parser.add_argument('--top', type=int, default=8, help='How many of the slowest imports to list per script.')
+parser.add_argument('--save', help='Write the results to this JSON file.')
+parser.add_argument('--compare', help='Compare against results saved with --save and exit 1 if a script got slower.')
+parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slowdown allowed by --compare.')
+args = parser.parse_args()
+
+
+def run(argv):
+    start = time.perf_counter()
+    p = subprocess.run(argv, cwd=REPO, capture_output=True, text=True)
+    return time.perf_counter() - start, p
+
+
+def parse_importtime(stderr):
+    """
+    Top-level imports from -X importtime output as (module, cumulative seconds), slowest first.
+    Nested imports are already included in their parent's cumulative time.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nesting is shown by indenting the module name with two more spaces per level.
+        name = name[1:]
+        if not name.startswith(' '):
+            imports.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(imports, key=lambda x: x[1], reverse=True)
+
+
+def measure(script):
+    argv = [sys.executable, script, '--help'] if script else [sys.executable, '-c', 'pass']
+    times = []
+    p = None
+    for _ in range(args.runs):
+        elapsed, p = run(argv)
+        times.append(elapsed)
+    # Separate run so -X importtime's own overhead doesn't skew the timings.
+    _, traced = run(argv[:1] + ['-X', 'importtime'] + argv[1:])
+    error = None
+    if p.returncode != 0:
+        error = (p.stderr.strip().splitlines() or ['exit code %d' % p.returncode])[-1]
+    return {'min': min(times), 'median': statistics.median(times), 'imports': parse_importtime(traced.stderr), 'error': error}
+
+
+def main():
+    scripts = args.scripts or sorted(os.path.basename(x) for x in glob.glob(os.path.join(REPO, '*.py')))
+    results = {'(interpreter)': measure(None)}
+    for script in scripts:
+        results[script] = measure(script)
+
+    baseline = results['(interpreter)']['min']
+    for script, r in results.items():
+        print(f'{script}: min {r["min"] * 1000:.0f} ms, median {r["median"] * 1000:.0f} ms, {(r["min"] - baseline) * 1000:.0f} ms over a bare interpreter')
+        if r['error']:
+            print(f'    failed: {r["error"]}')
+        for name, seconds in r['imports'][:args.top]:
+            print(f'    {seconds * 1000:7.1f} ms  {name}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            before = json.load(f)
+        slower = []
+        for script, r in results.items():
+            if script in before and script != '(interpreter)' and r['min'] > before[script]['min'] * (1 + args.tolerance):
+                slower.append(f'{script}: {before[script]["min"] * 1000:.0f} ms -> {r["min"] * 1000:.0f} ms')
+        if slower:
+            print('Slower than before:')
+            for x in slower:
+                print('    ' + x)
+            sys.exit(1)
+        print('No script got slower.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Run a check through check_daemon.py:
+
+    check_client.py [--socket /path/to.sock] check_matrix_synapse.py --type all ...
+
+If the daemon isn't running the check is run directly instead.
+"""
+import os
+import sys
+
+from checker import nagios
+from checker.daemon_client import DEFAULT_SOCKET, DEFAULT_TIMEOUT, SCRIPTS_DIR, DaemonUnavailable, run_check
+
+
+def main():
+    argv = sys.argv[1:]
+    socket_path = os.environ.get('CHECK_DAEMON_SOCKET', DEFAULT_SOCKET)
+    timeout = float(os.environ.get('CHECK_DAEMON_TIMEOUT', DEFAULT_TIMEOUT))
+    if argv[:1] == ['--socket']:
+        socket_path, argv = argv[1], argv[2:]
+    if not argv or argv[0] in ('-h', '--help'):
+        print('usage: check_client.py [--socket PATH] SCRIPT [ARGS...]')
+        sys.exit(0 if argv else -1)
+    script, argv = argv[0], argv[1:]
+
+    try:
+        code, stdout, stderr = run_check(socket_path, script, argv, timeout)
+    except DaemonUnavailable:
+        # The daemon isn't running or we can't reach it, run the check the normal way.
+        path = os.path.join(SCRIPTS_DIR, os.path.basename(script))
+        os.execv(sys.executable, [sys.executable, path] + argv)
+    except OSError as e:
+        # The daemon got the request and may have run the check, running it again could e.g. create a second federation test room.
+        print(f'UNKNOWN: lost the connection to the check daemon "{e}"')
+        sys.exit(nagios.UNKNOWN)
+    sys.stdout.write(stdout)
+    sys.stderr.write(stderr)
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
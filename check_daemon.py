@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import signal
+import sys
+
+from checker.daemon import CheckServer, DEFAULT_SOCKET, SCRIPTS_DIR, preload
+
+parser = argparse.ArgumentParser(description='Keep the check dependencies loaded and run checks for check_client.py.')
+parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket to listen on.')
+parser.add_argument('--scripts-dir', default=SCRIPTS_DIR, help='Directory of the check scripts that may be run.')
+parser.add_argument('--timeout', type=int, default=120, help='Kill a check that runs longer than this many seconds.')
+parser.add_argument('--max-children', type=int, default=100, help='How many checks may run at the same time.')
+args = parser.parse_args()
+
+
+def main():
+    # Turn SIGTERM into SystemExit so the socket gets cleaned up.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    loaded = preload()
+    server = CheckServer(args.socket, args.scripts_dir, args.timeout, args.max_children)
+    print(f'Preloaded {", ".join(loaded)}')
+    print(f'Listening on {args.socket}')
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,6 @@
 import argparse
 import asyncio
 import json
-import os
 import sys
 import time
 import traceback
@@ -10,55 +9,121 @@ import urllib
 from datetime import datetime
 from uuid import uuid4
 
-from nio import AsyncClient, AsyncClientConfig, JoinError, JoinResponse, LoginResponse, RoomCreateError, RoomGetEventResponse, RoomSendError
+from nio import AsyncClient, AsyncClientConfig, JoinError, JoinResponse, JoinedRoomsResponse, LoginError, RoomCreateError, RoomGetEventResponse, RoomSendError, SyncResponse
 
 import checker.nagios as nagios
-from checker.synapse_client import leave_all_rooms_async, leave_room_async
-
-parser = argparse.ArgumentParser(description='Test federation between two homeservers.')
-parser.add_argument('--bot1-user', required=True, help='User ID for bot 1.')
-parser.add_argument('--bot1-pw', required=True, help='Password for bot 1.')
-parser.add_argument('--bot1-hs', required=True, help='Homeserver for bot 1.')
-parser.add_argument('--bot1-auth-file', help="File to cache the bot's login details to.")
-parser.add_argument('--bot2-user', required=True, help='User ID for bot 2.')
-parser.add_argument('--bot2-pw', required=True, help='Password for bot 2.')
-parser.add_argument('--bot2-hs', required=True, help='Homeserver for bot 2.')
-parser.add_argument('--bot2-auth-file', help="File to cache the bot's login details to.")
+from checker import token_cache
+from checker.probe import summarize
+from checker.room_pool import RoomPool
+from checker.synapse_client import leave_all_rooms_async, leave_room_async, leave_rooms_async
+
+parser = argparse.ArgumentParser(description='Test federation between two homeservers, or between many with --mesh.')
+parser.add_argument('--bot1-user', help='User ID for bot 1.')
+parser.add_argument('--bot1-pw', help='Password for bot 1.')
+parser.add_argument('--bot1-hs', help='Homeserver for bot 1.')
+parser.add_argument('--bot1-auth-file', help="File to cache the bot's login details to. Defaults to a file in ~/.cache/icinga2-checks/tokens.")
+parser.add_argument('--bot2-user', help='User ID for bot 2.')
+parser.add_argument('--bot2-pw', help='Password for bot 2.')
+parser.add_argument('--bot2-hs', help='Homeserver for bot 2.')
+parser.add_argument('--bot2-auth-file', help="File to cache the bot's login details to. Defaults to a file in ~/.cache/icinga2-checks/tokens.")
 parser.add_argument('--timeout', type=float, default=90, help='Request timeout limit.')
+parser.add_argument('--receive', default='sync', choices=['sync', 'poll'],
+                    help='How the receiver waits for the message: a /sync long-poll filtered to the test room, or polling the event with backoff. Falls back to polling if sync fails.')
+parser.add_argument('--room-pool', help='Keep long-lived test rooms and track them in this state file instead of creating and leaving a room every run.')
+parser.add_argument('--room-max-age', type=float, default=24, help='Hours before a pooled test room is replaced with a new one.')
+parser.add_argument('--samples', type=int, default=1, help='Messages to send in each direction. The median time is compared against --warn and --crit and min/p50/p95/max and the share of lost messages are reported as perfdata.')
+parser.add_argument('--mesh', help='JSON file with a list of bots. Tests every direction between them instead of --bot1-* and --bot2-*.')
+parser.add_argument('--mesh-concurrency', type=int, default=4, help='How many directions of the mesh to test at the same time.')
+parser.add_argument('--deadline', type=float, default=120, help='All directions are tested at the same time and must finish within this many seconds. Cleanup gets whatever time is left, but at least 10 seconds.')
 parser.add_argument('--warn', type=float, default=2.0, help='Manually set warn level.')
 parser.add_argument('--crit', type=float, default=2.5, help='Manually set critical level.')
 args = parser.parse_args()
 
-bot1_hs_domain = urllib.parse.urlparse(args.bot1_hs).netloc
-bot2_hs_domain = urllib.parse.urlparse(args.bot2_hs).netloc
+if args.samples < 1:
+    parser.error('--samples must be at least 1')
+if args.mesh_concurrency < 1:
+    parser.error('--mesh-concurrency must be at least 1')
+
+if not args.mesh:
+    for bot in ('bot1', 'bot2'):
+        for arg in ('user', 'pw', 'hs'):
+            if not getattr(args, f'{bot}_{arg}'):
+                parser.error(f'--{bot}-{arg} is required without --mesh')
+    bot1_hs_domain = urllib.parse.urlparse(args.bot1_hs).netloc
+    bot2_hs_domain = urllib.parse.urlparse(args.bot2_hs).netloc
+
+
+def room_filter(room_id):
+    # Only the test room's new messages, nothing else the bot might be subscribed to. The limit has room for every sample
+    # and then some, a limited sync would drop some of them and they would be timed by the slower polling instead.
+    return {
+        'room': {
+            'rooms': [room_id],
+            'timeline': {'types': ['m.room.message'], 'limit': args.samples + 10},
+            'state': {'types': []},
+            'ephemeral': {'not_types': ['*']},
+            'account_data': {'not_types': ['*']},
+        },
+        'presence': {'not_types': ['*']},
+        'account_data': {'not_types': ['*']},
+    }
+
+
+async def sync_token(client, room_id):
+    """
+    A sync token from before the message is sent, so the long-poll in receive_event() only returns what's new.
+    """
+    if args.receive != 'sync':
+        return None
+    resp = await client.sync(timeout=0, sync_filter=room_filter(room_id))
+    return resp.next_batch if isinstance(resp, SyncResponse) else None
 
 
-def write_details_to_disk(resp: LoginResponse, homeserver, config_file) -> None:
-    """Writes the required login details to disk so we can log in later without
-    using a password.
-    Arguments:
-        resp {LoginResponse} -- the successful client login response.
-        homeserver -- URL of homeserver, e.g. "https://matrix.example.org"
+async def receive_events(client, room_id, event_ids, since):
+    """
+    Wait for `event_ids` to arrive at `client`. Returns {event ID: (event, time it was delivered)} for the ones that arrived before the timeout.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.timeout
+    received = {}
+
+    # The server holds the request open until something new happens in the room, so this returns as soon as an event is delivered.
+    while since and len(received) < len(event_ids) and loop.time() < deadline:
+        resp = await client.sync(timeout=int(min(deadline - loop.time(), 30) * 1000), sync_filter=room_filter(room_id), since=since)
+        now = time.time()
+        if not isinstance(resp, SyncResponse):
+            break
+        room = resp.rooms.join.get(room_id)
+        for event in room.timeline.events if room else []:
+            if event.source.get('event_id') in event_ids:
+                received[event.source['event_id']] = (event.source, now)
+        since = resp.next_batch
+
+    # Fall back to asking for the events, backing off so we don't hammer the server.
+    delay = 0.1
+    while len(received) < len(event_ids) and loop.time() < deadline:
+        for event_id in event_ids:
+            if event_id not in received:
+                resp = await client.room_get_event(room_id, event_id)
+                if isinstance(resp, RoomGetEventResponse):
+                    received[event_id] = (resp.event.source, time.time())
+        if len(received) < len(event_ids):
+            await asyncio.sleep(min(delay, max(deadline - loop.time(), 0)))
+            delay = min(delay * 2, 2)
+    return received
+
+
+async def create_test_room(sender_client, receiver_client, receiver_user_id, name=None):
+    """
+    The sender creates a room and invites the receiver, who joins it.
+    Returns (room ID, None), or (None, (error message, nagios code, leave failures)).
     """
-    # open the config file in write-mode
-    with open(config_file, "w") as f:
-        # write the login details to disk
-        json.dump({"homeserver": homeserver,  # e.g. "https://matrix.example.org"
-                   "user_id": resp.user_id,  # e.g. "@user:example.org"
-                   "device_id": resp.device_id,  # device ID, 10 uppercase letters
-                   "access_token": resp.access_token,  # cryptogr. access token
-                   }, f, )
-
-
-async def test_one_direction(sender_client, receiver_client, receiver_user_id):
-    # The sender creates the room and invites the receiver
-    test_room_name = str(uuid4())
-    new_test_room = await sender_client.room_create(name=test_room_name, invite=[receiver_user_id])
+    new_test_room = await sender_client.room_create(name=name or str(uuid4()), invite=[receiver_user_id])
     if isinstance(new_test_room, RoomCreateError):
-        return f'UNKNOWN: failed to create room "{new_test_room}"', nagios.UNKNOWN, []
+        return None, (f'UNKNOWN: failed to create room "{new_test_room}"', nagios.UNKNOWN, [])
     new_test_room_id = new_test_room.room_id
 
-    time.sleep(2)
+    await asyncio.sleep(2)
 
     # The receiver joins via invite
     timeout_start = datetime.now()
@@ -72,109 +137,244 @@ async def test_one_direction(sender_client, receiver_client, receiver_user_id):
             for event in leave:
                 if not event[0]:
                     leave_failures.append((event[1], event[2]))
-            return f'UNKNOWN: failed to join room "{vars(resp)}"', nagios.UNKNOWN, leave_failures
+            return None, (f'UNKNOWN: failed to join room "{vars(resp)}"', nagios.UNKNOWN, leave_failures)
         if (datetime.now() - timeout_start).total_seconds() >= args.timeout:
             leave = [await leave_room_async(new_test_room_id, sender_client)]
             leave_failures = []
             for event in leave:
                 if not event[0]:
                     leave_failures.append((event[1], event[2]))
-            return 'UNKNOWN: failed to join room, timeout.', nagios.UNKNOWN, leave_failures
-
-    time.sleep(2)
-
-    # Sender sends the msg to room
-    send_msg_time = datetime.now()
-    msg = {'id': str(uuid4()), 'ts': send_msg_time.microsecond}
-    resp = (await sender_client.room_send(new_test_room_id, 'm.room.message', {'body': json.dumps(msg), 'msgtype': 'm.room.message'}))
-    if isinstance(resp, RoomSendError):
-        leave = [await leave_room_async(new_test_room_id, sender_client), await leave_room_async(new_test_room_id, receiver_client)]
-        leave_failures = []
-        for event in leave:
-            if not event[0]:
-                leave_failures.append((event[1], event[2]))
-        return f'UNKNOWN: failed to send message "{resp}', nagios.UNKNOWN, leave_failures
-    msg_event_id = resp.event_id
-
-    # Sender watches for the message
-    start_check = datetime.now()
-    while True:
-        resp = await receiver_client.room_get_event(new_test_room_id, msg_event_id)
-        if isinstance(resp, RoomGetEventResponse):
-            recv_msg_time = datetime.now()
-            recv_msg = json.loads(resp.event.source['content']['body'])
-            break
-        if (datetime.now() - start_check).total_seconds() >= args.timeout:
+            return None, ('UNKNOWN: failed to join room, timeout.', nagios.UNKNOWN, leave_failures)
+
+    await asyncio.sleep(2)
+    return new_test_room_id, None
+
+
+async def send_test_message(sender_client, receiver_client, room_id):
+    """
+    Send --samples messages and time how long each takes to reach the receiver.
+    The messages are sent one after the other without waiting for the previous one to arrive.
+    Returns (latency stats, nagios code) or (error message, nagios code).
+    """
+    since = await sync_token(receiver_client, room_id)
+
+    # Sender sends the msgs to the room
+    sent = {}
+    for _ in range(args.samples):
+        msg = {'id': str(uuid4()), 'ts': time.time()}
+        resp = (await sender_client.room_send(room_id, 'm.room.message', {'body': json.dumps(msg), 'msgtype': 'm.room.message'}))
+        if isinstance(resp, RoomSendError):
+            return f'UNKNOWN: failed to send message "{resp}', nagios.UNKNOWN
+        sent[resp.event_id] = msg
+
+    # Receiver watches for the messages
+    received = await receive_events(receiver_client, room_id, set(sent), since)
+    if not received:
+        return "CRITICAL: timeout - receiver did not recieve the sender's message.", nagios.CRITICAL
+
+    # Double check everything makes sense
+    latencies = []
+    for event_id, (event, recv_msg_time) in received.items():
+        if json.loads(event['content']['body']) != sent[event_id]:
+            return "CRITICAL: sender's message did not match the receiver's.", nagios.CRITICAL
+        # The time it took to recieve the message, including sync
+        latencies.append(recv_msg_time - sent[event_id]['ts'])
+
+    stats = summarize(latencies)
+    stats['loss'] = 1 - len(received) / len(sent)
+    return stats, nagios.OK
+
+
+async def test_one_direction(sender_client, receiver_client, receiver_user_id, pool=None, joined=None):
+    """
+    Returns (latency stats or error message, nagios code, the room to leave or the rooms that failed to leave).
+    With a room pool the pooled room is used, or created if there is none, and nothing has to be left.
+    """
+    if pool is None:
+        new_test_room_id, error = await create_test_room(sender_client, receiver_client, receiver_user_id)
+        if error:
+            return error
+        result, code = await send_test_message(sender_client, receiver_client, new_test_room_id)
+        if code != nagios.OK:
             leave = [await leave_room_async(new_test_room_id, sender_client), await leave_room_async(new_test_room_id, receiver_client)]
             leave_failures = []
             for event in leave:
                 if not event[0]:
                     leave_failures.append((event[1], event[2]))
-            return "CRITICAL: timeout - receiver did not recieve the sender's message.", nagios.CRITICAL, leave_failures
+            return result, code, leave_failures
+        return result, code, new_test_room_id
+
+    key = f'{sender_client.user_id}->{receiver_client.user_id}'
+    room_id = pool.get(key)
+    if room_id not in joined[sender_client.user_id] or room_id not in joined[receiver_client.user_id]:
+        # No room yet, it's due for rotation, or one of the bots isn't in it anymore.
+        room_id, error = await create_test_room(sender_client, receiver_client, receiver_user_id, name=f'_PERM_probe {key}')
+        if error:
+            return error
+        pool.set(key, room_id)
+    result, code = await send_test_message(sender_client, receiver_client, room_id)
+    if code == nagios.UNKNOWN:
+        # Sending failed, e.g. the bot was kicked. Start over with a new room next time.
+        pool.discard(key)
+    return result, code, None
 
-    # Double check everything makes sense
-    if not msg == recv_msg:
-        leave = [await leave_room_async(new_test_room_id, sender_client), await leave_room_async(new_test_room_id, receiver_client)]
-        leave_failures = []
-        for event in leave:
-            if not event[0]:
-                leave_failures.append((event[1], event[2]))
-        return "CRITICAL: sender's message did not match the receiver's.", nagios.CRITICAL, leave_failures
 
-    # Calculate the time it took to recieve the message, including sync
-    bot1_msg_delta = (recv_msg_time - send_msg_time).total_seconds()
+async def login(user_id, passwd, homeserver, config_file=None):
+    """
+    Returns the logged in client, or the LoginError. max_timeouts stops nio from retrying an unreachable homeserver forever.
+    """
+    client = AsyncClient(homeserver, user_id, config=AsyncClientConfig(request_timeout=args.timeout, max_timeouts=3, max_timeout_retry_wait_time=10))
+    try:
+        resp = await token_cache.login(client, passwd, config_file)
+    except BaseException:
+        await client.close()
+        raise
+    if isinstance(resp, LoginError):
+        await client.close()
+        return resp
+    return client
+
 
-    return bot1_msg_delta, nagios.OK, new_test_room_id
+def login_error(resp):
+    if isinstance(resp, asyncio.TimeoutError):
+        return f'timeout - failed to log in within {args.deadline} seconds.'
+    elif isinstance(resp, LoginError):
+        return f'failed to log in "{resp}"'
+    return f'exception while logging in "{resp}"'
 
 
-async def login(user_id, passwd, homeserver, config_file=None):
-    client = AsyncClient(homeserver, user_id, config=AsyncClientConfig(request_timeout=args.timeout, max_timeout_retry_wait_time=10))
-    if config_file:
-        # If there are no previously-saved credentials, we'll use the password
-        if not os.path.exists(config_file):
-            resp = await client.login(passwd)
-
-            # check that we logged in successfully
-            if isinstance(resp, LoginResponse):
-                write_details_to_disk(resp, homeserver, config_file)
-            else:
-                print(f'UNKNOWN: failed to log in "{resp}"')
-                sys.exit(nagios.UNKNOWN)
+async def login_all(bots, deadline):
+    """
+    Log in every (user, password, homeserver, auth file) at the same time, each one has until `deadline` (loop time).
+    Returns a client or an error message for each.
+    """
+    loop = asyncio.get_running_loop()
+    results = await asyncio.gather(*(asyncio.wait_for(login(*bot), timeout=max(deadline - loop.time(), 0)) for bot in bots), return_exceptions=True)
+    return [resp if isinstance(resp, AsyncClient) else login_error(resp) for resp in results]
+
+
+async def finish_by(coros, deadline):
+    """
+    Run the tests at the same time. A test that hasn't finished by `deadline` (loop time) is cancelled and reported as critical.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.create_task(coro) for coro in coros]
+    done, pending = await asyncio.wait(tasks, timeout=max(deadline - loop.time(), 0))
+    for task in pending:
+        task.cancel()
+    results = []
+    for task in tasks:
+        if task in pending:
+            results.append((f'CRITICAL: timeout - the test did not finish within {args.deadline} seconds.', nagios.CRITICAL, []))
+        elif task.exception():
+            results.append((f'UNKNOWN: exception "{task.exception()}"', nagios.UNKNOWN, []))
         else:
-            # Otherwise the config file exists, so we'll use the stored credentials
-            with open(config_file, "r") as f:
-                config = json.load(f)
-                client = AsyncClient(config["homeserver"])
-                client.access_token = config["access_token"]
-                client.user_id = config["user_id"]
-                client.device_id = config["device_id"]
-    else:
-        await client.login(passwd)
-    return client
+            results.append(task.result())
+    return results
+
+
+async def run_pairs(pairs, deadline, pool=None, joined=None, concurrency=None):
+    """
+    Test each (sender, receiver) pair, at most `concurrency` at a time.
+    """
+    semaphore = asyncio.Semaphore(concurrency or len(pairs))
+
+    async def one(sender, receiver):
+        async with semaphore:
+            return await test_one_direction(sender, receiver, receiver.user_id, pool, joined)
+
+    return await finish_by([one(sender, receiver) for sender, receiver in pairs], deadline)
+
+
+async def run_directions(bot1, bot2, deadline, pool=None, joined=None):
+    """
+    Test bot1 -> bot2 and bot2 -> bot1 at the same time.
+    """
+    return await run_pairs([(bot1, bot2), (bot2, bot1)], deadline, pool, joined)
+
+
+async def cleanup_bots(bots, room_ids, pool=None, joined=None):
+    """
+    Leave the test rooms, then anything else the bots are still in.
+    Returns the rooms that failed to leave and the leave_all_rooms_async() results of each bot.
+    """
+    leave = await asyncio.gather(*(leave_rooms_async(bot, room_ids) for bot in bots))
+    leave_failures = [(event[1], event[2]) for results in leave for event in results if not event[0]]
+    if pool is not None:
+        # Only leave rooms that were rotated out of the pool. This saves leave_all_rooms_async()'s sync.
+        keep = pool.room_ids()
+        leave = await asyncio.gather(*(leave_rooms_async(bot, joined[bot.user_id] - keep) for bot in bots))
+        return leave_failures + [(event[1], event[2]) for results in leave for event in results if not event[0]], [[] for _ in bots]
+    return leave_failures, await asyncio.gather(*(leave_all_rooms_async(bot, exclude_starting_with='_PERM_') for bot in bots))
+
+
+async def cleanup(bot1, bot2, room_ids, pool=None, joined=None):
+    leave_failures, (bot1_leave_all_failures, bot2_leave_all_failures) = await cleanup_bots((bot1, bot2), room_ids, pool, joined)
+    return leave_failures, bot1_leave_all_failures, bot2_leave_all_failures
+
+
+def check_latency(name, stats):
+    """
+    Compare a direction's median time against --warn and --crit. Returns (nagios code, message).
+    """
+    p50 = round(stats['p50'], 2)
+    text = f'{name} is {p50} seconds.'
+    if args.samples > 1:
+        text = f'{name} is {p50} seconds (min {round(stats["min"], 2)}, p95 {round(stats["p95"], 2)}, max {round(stats["max"], 2)}).'
+    if p50 >= args.crit:
+        return nagios.CRITICAL, f'CRITICAL: {text}'
+    elif p50 >= args.warn:
+        return nagios.WARNING, f'WARNING: {text}'
+    elif stats['loss']:
+        return nagios.WARNING, f'WARNING: {text} {round(stats["loss"] * args.samples)} of {args.samples} messages did not arrive.'
+    return nagios.OK, f'OK: {text}'
+
+
+def latency_perfdata(label, stats):
+    perf_data = [f"'{label}'={round(stats['p50'], 2)}s;{args.warn};{args.crit};;"]
+    if args.samples > 1:
+        perf_data += [f"'{label}_{k}'={round(stats[k], 2)}s;;;" for k in ('min', 'p95', 'max')]
+        perf_data.append(f"'{label}_loss'={round(stats['loss'] * 100)}%;;;")
+    return perf_data
 
 
 async def main() -> None:
-    bot1 = await login(args.bot1_user, args.bot1_pw, args.bot1_hs, args.bot1_auth_file)
-    bot2 = await login(args.bot2_user, args.bot2_pw, args.bot2_hs, args.bot2_auth_file)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.deadline
+    bot1, bot2 = await login_all([(args.bot1_user, args.bot1_pw, args.bot1_hs, args.bot1_auth_file), (args.bot2_user, args.bot2_pw, args.bot2_hs, args.bot2_auth_file)], deadline)
+    if isinstance(bot1, str) or isinstance(bot2, str):
+        await asyncio.gather(*(bot.close() for bot in (bot1, bot2) if isinstance(bot, AsyncClient)))
+        print(f'UNKNOWN: {bot1 if isinstance(bot1, str) else bot2}')
+        sys.exit(nagios.UNKNOWN)
 
-    bot1_output_msg, bot1_output_code, bot1_new_room_id = await test_one_direction(bot1, bot2, args.bot2_user)
-    bot2_output_msg, bot2_output_code, bot2_new_room_id = await test_one_direction(bot2, bot1, args.bot1_user)
+    pool = joined = None
+    if args.room_pool:
+        pool = RoomPool(args.room_pool, max_age=args.room_max_age * 3600)
+        joined = {bot.user_id: set(resp.rooms) if isinstance(resp, JoinedRoomsResponse) else set() for bot, resp in zip((bot1, bot2), await asyncio.gather(bot1.joined_rooms(), bot2.joined_rooms()))}
 
-    # Clean up
-    leave = [await leave_room_async(bot1_new_room_id, bot1), await leave_room_async(bot2_new_room_id, bot1), await leave_room_async(bot1_new_room_id, bot2), await leave_room_async(bot2_new_room_id, bot2)]
-    leave_failures = []
-    for event in leave:
-        if not event[0]:
-            leave_failures.append((event[1], event[2]))
+    (bot1_output_msg, bot1_output_code, bot1_new_room_id), (bot2_output_msg, bot2_output_code, bot2_new_room_id) = await run_directions(bot1, bot2, deadline, pool, joined)
 
-    bot1_leave_all_failures = await leave_all_rooms_async(bot1, exclude_starting_with='_PERM_')
-    bot2_leave_all_failures = await leave_all_rooms_async(bot2, exclude_starting_with='_PERM_')
-    await bot1.close()
-    await bot2.close()
+    # A failed direction returns the rooms it failed to leave instead of its room ID
+    room_ids = [x for x in (bot1_new_room_id, bot2_new_room_id) if isinstance(x, str)]
+    leave_failures = []
+    for x in (bot1_new_room_id, bot2_new_room_id):
+        if isinstance(x, list):
+            leave_failures += x
 
     nagios_output = nagios.OK
     prints = []
 
+    # Clean up
+    try:
+        cleanup_failures, bot1_leave_all_failures, bot2_leave_all_failures = await asyncio.wait_for(cleanup(bot1, bot2, room_ids, pool, joined), timeout=max(deadline - loop.time(), 10))
+        leave_failures += cleanup_failures
+    except asyncio.TimeoutError:
+        bot1_leave_all_failures = bot2_leave_all_failures = []
+        prints.append('WARN: cleanup did not finish in time, the next run will leave the remaining rooms.')
+        nagios_output = nagios.WARNING
+    await bot1.close()
+    await bot2.close()
+
     if bot1_output_code != nagios.OK:
         prints.append(bot1_output_msg)
         nagios_output = bot1_output_code
@@ -184,33 +384,15 @@ async def main() -> None:
             # Only set the code if our code is more severe
             nagios_output = bot2_output_code
 
-    # bot1 -> bot2
-    if isinstance(bot1_output_msg, float):  # only do this if the func returned a value
-        bot1_output_msg = round(bot1_output_msg, 2)
-        if bot1_output_msg >= args.crit:
-            if nagios_output < nagios.CRITICAL:
-                nagios_output = nagios.CRITICAL
-            prints.append(f'CRITICAL: {bot1_hs_domain} -> {bot2_hs_domain} is {bot1_output_msg} seconds.')
-        elif bot1_output_msg >= args.warn:
-            if nagios_output < nagios.WARNING:
-                nagios_output = nagios.WARNING
-            prints.append(f'WARNING: {bot1_hs_domain} -> {bot2_hs_domain} is {bot1_output_msg} seconds.')
-        else:
-            prints.append(f'OK: {bot1_hs_domain} -> {bot2_hs_domain} is {bot1_output_msg} seconds.')
-
-    # bot2 -> bot1
-    if isinstance(bot2_output_msg, float):
-        bot2_output_msg = round(bot2_output_msg, 2)
-        if bot2_output_msg >= args.crit:
-            if nagios_output < nagios.CRITICAL:
-                nagios_output = nagios.CRITICAL
-            prints.append(f'CRITICAL: {bot1_hs_domain} <- {bot2_hs_domain} is {bot2_output_msg} seconds.')
-        elif bot2_output_msg >= args.warn:
-            if nagios_output < nagios.WARNING:
-                nagios_output = nagios.WARNING
-            prints.append(f'WARNING: {bot1_hs_domain} <- {bot2_hs_domain} is {bot2_output_msg} seconds.')
-        else:
-            prints.append(f'OK: {bot1_hs_domain} <- {bot2_hs_domain} is {bot2_output_msg} seconds.')
+    perf_data = []
+    for label, arrow, stats in (('outbound', '->', bot1_output_msg), ('inbound', '<-', bot2_output_msg)):
+        if not isinstance(stats, dict):  # A direction that failed has its error message instead
+            continue
+        code, text = check_latency(f'{bot1_hs_domain} {arrow} {bot2_hs_domain}', stats)
+        prints.append(text)
+        if nagios_output < code:
+            nagios_output = code
+        perf_data += latency_perfdata(f'{bot1_hs_domain}_{label}', stats)
 
     if len(leave_failures):
         prints.append('=================================')
@@ -244,14 +426,112 @@ async def main() -> None:
 
     for x in prints:
         print(f'\n{x}', end=' ')
-    print(f"|'{bot1_hs_domain}_outbound'={bot1_output_msg}s;;; '{bot1_hs_domain}_inbound'={bot2_output_msg}s;;;")
+    print(f"|{' '.join(perf_data)}")
+
+    sys.exit(nagios_output)
+
+
+async def mesh_main() -> None:
+    """
+    Test federation between every bot in the --mesh file. The file looks like
+        {"hub": "example.com", "bots": [{"name": "example.com", "user": "@bot:example.com", "pw": "...", "hs": "https://matrix.example.com", "auth_file": "..."}, ...]}
+    name defaults to the homeserver's domain and auth_file is optional. With a hub only the directions to and from the hub are tested,
+    otherwise every direction between every pair of bots.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.deadline
+    with open(args.mesh) as f:
+        config = json.load(f)
+    names = [bot.get('name') or urllib.parse.urlparse(bot['hs']).netloc for bot in config['bots']]
+    hub = config.get('hub')
+    if hub is not None and hub not in names:
+        print(f'UNKNOWN: hub "{hub}" is not one of the bots')
+        sys.exit(nagios.UNKNOWN)
+
+    pool = joined = None
+    if args.room_pool:
+        pool = RoomPool(args.room_pool, max_age=args.room_max_age * 3600)
+        joined = {}
+
+    async def log_in(bot):
+        client = await login(bot['user'], bot['pw'], bot['hs'], bot.get('auth_file'))
+        if isinstance(client, AsyncClient) and pool is not None:
+            resp = await client.joined_rooms()
+            joined[client.user_id] = set(resp.rooms) if isinstance(resp, JoinedRoomsResponse) else set()
+        return client
+
+    logins = {name: asyncio.create_task(log_in(bot)) for name, bot in zip(names, config['bots'])}
+    semaphore = asyncio.Semaphore(args.mesh_concurrency)
+
+    async def direction(sender, receiver):
+        # Each direction starts as soon as both of its bots are logged in. A bot that can't log in, or whose homeserver
+        # doesn't answer, only fails its own directions and the rest of the matrix is still reported.
+        clients = await asyncio.gather(logins[sender], logins[receiver], return_exceptions=True)
+        for name, client in zip((sender, receiver), clients):
+            if not isinstance(client, AsyncClient):
+                return f'UNKNOWN: {name} {login_error(client)}', nagios.UNKNOWN, []
+        async with semaphore:
+            return await test_one_direction(clients[0], clients[1], clients[1].user_id, pool, joined)
+
+    pairs = [(sender, receiver) for sender in names for receiver in names if sender != receiver and hub in (None, sender, receiver)]
+    results = dict(zip(pairs, await finish_by([direction(sender, receiver) for sender, receiver in pairs], deadline)))
+    for name, task in logins.items():
+        if not task.done():
+            task.cancel()
+            for pair in pairs:
+                if name in pair:
+                    results[pair] = (f'UNKNOWN: {name} {login_error(asyncio.TimeoutError())}', nagios.UNKNOWN, [])
+    await asyncio.gather(*logins.values(), return_exceptions=True)
+    clients = [task.result() for task in logins.values() if not task.cancelled() and task.exception() is None and isinstance(task.result(), AsyncClient)]
+
+    # A failed direction returns the rooms it failed to leave instead of its room ID
+    room_ids = [x for _, _, x in results.values() if isinstance(x, str)]
+    leave_failures = [failure for _, _, x in results.values() if isinstance(x, list) for failure in x]
+
+    nagios_output = nagios.OK
+    prints = []
+    try:
+        cleanup_failures, leave_all_failures = await asyncio.wait_for(cleanup_bots(clients, room_ids, pool, joined), timeout=max(deadline - loop.time(), 10))
+        leave_failures += cleanup_failures + [err for failures in leave_all_failures for err in failures if not err[0]]
+    except asyncio.TimeoutError:
+        prints.append('WARN: cleanup did not finish in time, the next run will leave the remaining rooms.')
+        nagios_output = nagios.WARNING
+    await asyncio.gather(*(bot.close() for bot in clients))
+
+    perf_data = []
+    ok = 0
+    for sender, receiver in pairs:
+        result, code, _ = results[(sender, receiver)]
+        if code == nagios.OK:
+            perf_data += latency_perfdata(f'{sender}_to_{receiver}', result)
+            code, result = check_latency(f'{sender} -> {receiver}', result)
+        else:
+            result = f'{sender} -> {receiver}: {result}'
+        if code == nagios.OK:
+            ok += 1
+        prints.append(result)
+        nagios_output = nagios.worst(nagios_output, code)
+
+    if len(leave_failures):
+        prints.append('=================================')
+        prints.append('WARN: a bot failed to leave a room:')
+        for err in leave_failures:
+            prints.append(err)
+        if nagios_output < nagios.WARNING:
+            nagios_output = nagios.WARNING
+
+    state = {nagios.UNKNOWN: 'UNKNOWN', nagios.OK: 'OK', nagios.WARNING: 'WARNING', nagios.CRITICAL: 'CRITICAL'}[nagios_output]
+    print(f'{state}: {ok} of {len(pairs)} directions are OK.')
+    for x in prints:
+        print(x)
+    print(f"|{' '.join(perf_data)}")
 
     sys.exit(nagios_output)
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        asyncio.run(mesh_main() if args.mesh else main())
     except Exception as e:
         print(f"UNKNOWN: exception\n{e}")
         print(traceback.format_exc())
@@ -1,121 +1,230 @@
 #!/usr/bin/env python3
 import argparse
 import sys
-import time
 import traceback
 
-import numpy as np
-import requests
-
 from checker import nagios
-from checker.synapse_grafana import get_avg_python_gc_time, get_event_send_time, get_outgoing_http_request_rate, get_waiting_for_db
+from checker.cache import FileCache
+from checker.datasource import GrafanaDatasource, PrometheusDatasource
+from checker.registry import load_registry
+from checker.synapse_grafana import get_all, get_metric, get_metric_distribution, values_match
 
 parser = argparse.ArgumentParser(description='Process some integers.')
-parser.add_argument('--grafana-server', required=True, help='Grafana server.')
+parser.add_argument('--grafana-server', help='Grafana server.')
 parser.add_argument('--synapse-server', required=True, help='Matrix Synapse server.')
-parser.add_argument('--grafana-api-key', required=True)
+parser.add_argument('--grafana-api-key')
+parser.add_argument('--grafana-datasource-uid', help='UID of the Prometheus datasource in Grafana. Defaults to the one in the metrics file.')
+parser.add_argument('--prometheus-server', help='Prometheus server. Used instead of Grafana when --datasource is prometheus.')
+parser.add_argument('--datasource', default='grafana', choices=['grafana', 'prometheus'], help='Query the metrics through Grafana or directly from Prometheus.')
+parser.add_argument('--metrics-file', help='Metric definitions to use instead of checker/metrics.json.')
+parser.add_argument('--instance', help='Prometheus instance label of Synapse. Overrides the one in the metrics file.')
+parser.add_argument('--jobs', help='Regex matching the Prometheus job labels of your workers. Overrides the one in the metrics file.')
 parser.add_argument('--interval', default=15, type=int, help='Data interval in seconds.')
 parser.add_argument('--range', default=2, type=int, help='Data range in minutes. Used for comparison and averaging.')
-parser.add_argument('--type', required=True, choices=['gc-time', 'response-time', 'outgoing-http-rate', 'avg-send', 'db-lag'])
+parser.add_argument('--type', required=True, help='response-time, a metric from the metrics file (gc-time, outgoing-http-rate, avg-send, db-lag, stateres), '
+                                                  'or "all" to check every metric with a single query and report them as one result. --warn and --crit are ignored in that mode.')
 parser.add_argument('--warn', type=float, help='Manually set warn level.')
 parser.add_argument('--crit', type=float, help='Manually set critical level.')
+parser.add_argument('--latency-distribution', action='store_true',
+                    help='For metrics that have distribution queries (avg-send), also fetch the latency quantiles and report them as perfdata. '
+                         'Thresholds still apply to the mean only.')
+parser.add_argument('--reduction', default='client', choices=['client', 'server', 'verify'],
+                    help='Average the range locally (client) or in PromQL so only one point per series is downloaded (server). '
+                         '"verify" runs both and reports whether they agree.')
+parser.add_argument('--verify-tolerance', default=0.05, type=float, help='Relative difference allowed between client and server reduction in verify mode.')
+parser.add_argument('--samples', default=10, type=int, help='Number of requests made by the response-time check.')
+parser.add_argument('--concurrency', default=5, type=int, help='How many response-time requests may be in flight at once.')
+parser.add_argument('--pacing', default=0.1, type=float, help='Seconds between starting two response-time requests.')
+parser.add_argument('--fresh-connections', action='store_true', help='Open a new connection for every response-time request so the TCP and TLS handshake are measured too.')
+parser.add_argument('--timeout', default=10, type=float, help='Timeout in seconds for a single response-time request.')
+parser.add_argument('--cache-dir', help='Share Grafana responses with other checks through this directory. Disabled if not set.')
+parser.add_argument('--cache-ttl', default=30, type=int, help='How long in seconds a cached Grafana response may be reused.')
 args = parser.parse_args()
 
+if args.samples < 1:
+    parser.error('--samples must be at least 1')
+if args.concurrency < 1:
+    parser.error('--concurrency must be at least 1')
 
-# TODO: add warn suppoort
+registry = load_registry(args.metrics_file, instance=args.instance, jobs=args.jobs)
+if args.type not in registry.checks() + ['response-time', 'all']:
+    parser.error(f'--type must be one of: {", ".join(registry.checks() + ["response-time", "all"])}')
 
-def main():
-    if args.type == 'gc-time':
-        # in seconds
-        python_gc_time_sum_MAX = 0.002 if not args.crit else args.crit
+cache = FileCache(args.cache_dir, args.cache_ttl) if args.cache_dir else None
+
+if args.datasource == 'prometheus':
+    if not args.prometheus_server:
+        parser.error('--prometheus-server is required when --datasource is prometheus')
+    datasource = PrometheusDatasource(args.prometheus_server, cache=cache)
+else:
+    if not args.grafana_server or not args.grafana_api_key:
+        parser.error('--grafana-server and --grafana-api-key are required when --datasource is grafana')
+    datasource = GrafanaDatasource(args.grafana_server, args.grafana_api_key, args.grafana_datasource_uid or registry.grafana_datasource_uid, cache=cache)
+
+
+def check_metric(name, value, warn=None, crit=None):
+    """
+    Compare a reduced metric against its thresholds from the metrics file, or --warn/--crit if given.
+    Returns (exit code, message, perfdata).
+    """
+    metric = registry.metrics[name]
+    crit = metric['crit'] if not crit else crit
+    warn = metric.get('warn') if not warn else warn
+
+    def over(v, threshold):
+        return threshold is not None and (v >= threshold if metric['compare'] == '>=' else v > threshold)
+
+    values = value if isinstance(value, dict) else {metric['perfdata']: value}
+    # The effective thresholds go into the perfdata so graphing tools can draw and alert on them.
+    thresholds = f"{'' if warn is None else warn};{'' if crit is None else crit}"
+    perf_data = ' '.join(f"'{k}'={v}{metric['unit']};{thresholds};;" for k, v in values.items())
+    crit_failed = {k: v for k, v in values.items() if over(v, crit)}
+    warn_failed = {k: v for k, v in values.items() if over(v, warn)}
+    if crit_failed:
+        return nagios.CRITICAL, 'CRITICAL: ' + metric['message'].format(value=crit_failed if isinstance(value, dict) else value), perf_data
+    if warn_failed:
+        return nagios.WARNING, 'WARNING: ' + metric['message'].format(value=warn_failed if isinstance(value, dict) else value), perf_data
+    return nagios.OK, 'OK: ' + metric['message'].format(value=value), perf_data
+
+
+def check_reduction(types):
+    try:
+        client_values = get_all(datasource, args.interval, args.range, types=types, reduction='client', registry=registry)
+        server_values = get_all(datasource, args.interval, args.range, types=types, reduction='server', registry=registry)
+    except Exception as e:
+        print(f'UNKNOWN: failed to query {args.datasource} "{e}"')
+        print(traceback.format_exc())
+        sys.exit(nagios.UNKNOWN)
+
+    exit_code = nagios.OK
+    prints = []
+    for name in types:
+        client_value, server_value = client_values[name], server_values[name]
+        if isinstance(client_value, Exception) or isinstance(server_value, Exception):
+            prints.append(f'UNKNOWN: {name} failed. Client: "{client_value}" Server: "{server_value}"')
+            if exit_code == nagios.OK:
+                exit_code = nagios.UNKNOWN
+        elif values_match(client_value, server_value, args.verify_tolerance):
+            prints.append(f'OK: {name} matches. Client: {client_value} Server: {server_value}')
+        else:
+            prints.append(f'WARNING: {name} does not match. Client: {client_value} Server: {server_value}')
+            exit_code = nagios.WARNING
+
+    if exit_code == nagios.OK:
+        print('OK: server-side reduction matches the client-side result.')
+    elif exit_code == nagios.WARNING:
+        print('WARNING: server-side reduction does not match the client-side result.')
+    else:
+        print('UNKNOWN: could not compare server-side and client-side reduction.')
+    for x in prints:
+        print(x)
+    sys.exit(exit_code)
+
+
+def check_all():
+    try:
+        values = get_all(datasource, args.interval, args.range, types=registry.checks(), reduction=args.reduction, registry=registry)
+    except Exception as e:
+        print(f'UNKNOWN: failed to query {args.datasource} "{e}"')
+        print(traceback.format_exc())
+        sys.exit(nagios.UNKNOWN)
+
+    exit_code = nagios.OK
+    prints = []
+    perf_data = []
+    for name in registry.checks():
+        value = values[name]
         try:
-            python_gc_time_sum = np.round(np.average(get_avg_python_gc_time(args.grafana_api_key, args.interval, args.range, args.grafana_server)), 5)
-            if python_gc_time_sum >= python_gc_time_sum_MAX:
-                print(f"CRITICAL: average GC time per collection is {python_gc_time_sum} sec. |'garbage-collection'={python_gc_time_sum}s;;;")
-                sys.exit(nagios.CRITICAL)
-            else:
-                print(f"OK: average GC time per collection is {python_gc_time_sum} sec. |'garbage-collection'={python_gc_time_sum}s;;;")
-                sys.exit(nagios.OK)
+            if isinstance(value, Exception):
+                raise value
+            code, text, perf = check_metric(name, value)
+            perf_data.append(perf)
         except Exception as e:
-            print(f'UNKNOWN: failed to check avg. GC time "{e}"')
-            print(traceback.format_exc())
-            sys.exit(nagios.UNKNOWN)
+            code, text = nagios.UNKNOWN, f'UNKNOWN: failed to check {registry.metrics[name]["description"]} "{e}"'
+        prints.append(text)
+        exit_code = nagios.worst(exit_code, code)
+
+    failed = len([x for x in prints if not x.startswith('OK')])
+    if exit_code == nagios.OK:
+        print(f'OK: all {len(prints)} metrics are good.')
+    elif exit_code == nagios.WARNING:
+        print(f'WARNING: {failed} of {len(prints)} metrics are bad.')
+    elif exit_code == nagios.CRITICAL:
+        print(f'CRITICAL: {failed} of {len(prints)} metrics are bad.')
+    else:
+        print(f'UNKNOWN: {failed} of {len(prints)} metrics could not be checked.')
+    for x in prints:
+        print(x)
+    print(f'|{" ".join(perf_data)}')
+    sys.exit(exit_code)
+
+
+def check_response_time():
+    from checker.http_timing import timing_perfdata
+    from checker.probe import probe, summarize
+
+    crit = 1 if not args.crit else args.crit
+    try:
+        results = probe(args.synapse_server, samples=args.samples, concurrency=args.concurrency, pacing=args.pacing,
+                        reuse_connections=not args.fresh_connections, timeout=args.timeout)
+    except Exception as e:
+        print(f'UNKNOWN: failed to check response time "{e}"')
+        print(traceback.format_exc())
+        sys.exit(nagios.UNKNOWN)
+
+    timings = [x for x in results if not isinstance(x, Exception)]
+    times = [x.total for x in timings]
+    # Timeouts have an empty message
+    errors = [str(x) or type(x).__name__ for x in results if isinstance(x, Exception)]
+    if not times:
+        print(f'UNKNOWN: failed to ping endpoint "{errors[0]}"')
+        sys.exit(nagios.UNKNOWN)
+
+    stats = {k: round(v, 3) for k, v in summarize(times).items()}
+    perf_data = ' '.join(f"'response-time-{k}'={stats[k]}s;;;" for k in ('p50', 'p95', 'max', 'stddev'))
+    perf_data = f"'response-time'={stats['mean']}s;{args.warn or ''};{crit};; {perf_data} 'response-time-failed'={len(errors)};;; {timing_perfdata('response-time', timings)}"
+    text = f"response time is {stats['mean']} sec. (p50 {stats['p50']}, p95 {stats['p95']}, max {stats['max']})"
+    if stats['mean'] > crit:
+        print(f'CRITICAL: {text} |{perf_data}')
+        sys.exit(nagios.CRITICAL)
+    elif args.warn and stats['mean'] > args.warn:
+        print(f'WARNING: {text} |{perf_data}')
+        sys.exit(nagios.WARNING)
+    elif errors:
+        print(f'WARNING: {len(errors)} of {len(results)} requests failed, {text}\nlast error: "{errors[-1]}" |{perf_data}')
+        sys.exit(nagios.WARNING)
+    print(f'OK: {text} |{perf_data}')
+    sys.exit(nagios.OK)
+
+
+def main():
+    if args.reduction == 'verify' and args.type != 'response-time':
+        check_reduction(registry.checks() if args.type == 'all' else [args.type])
+    elif args.type == 'all':
+        check_all()
     elif args.type == 'response-time':
-        response_time_MAX = 1 if not args.crit else args.crit
-        timeout = 10
-        try:
-            response_times = []
-            for i in range(10):
-                start = time.perf_counter()
-                try:
-                    response = requests.post(args.synapse_server, timeout=timeout, verify=False)
-                except Exception as e:
-                    print(f'UNKNOWN: failed to ping endpoint "{e}"')
-                    print(traceback.format_exc())
-                    sys.exit(nagios.UNKNOWN)
-                request_time = time.perf_counter() - start
-                response_times.append(np.round(request_time, 2))
-                time.sleep(1)
-            response_time = np.round(np.average(response_times), 2)
-            if response_time > response_time_MAX:
-                print(f"CRITICAL: response time is {response_time} sec. |'response-time'={response_time}s;;;")
-                sys.exit(nagios.CRITICAL)
-            else:
-                print(f"OK: response time is {response_time} sec. |'response-time'={response_time}s;;;")
-                sys.exit(nagios.OK)
-        except Exception as e:
-            print(f'UNKNOWN: failed to check response time "{e}"')
-            print(traceback.format_exc())
-            sys.exit(nagios.UNKNOWN)
-    elif args.type == 'outgoing-http-rate':
-        # outgoing req/sec
-        outgoing_http_request_rate_MAX = 10 if not args.crit else args.crit
-        try:
-            outgoing_http_request_rate = get_outgoing_http_request_rate(args.grafana_api_key, args.interval, args.range, args.grafana_server)
-            failed = {}
-            perf_data = '|'
-            for k, v in outgoing_http_request_rate.items():
-                perf_data = perf_data + f"'{k}'={v}s;;; "
-                if v > outgoing_http_request_rate_MAX:
-                    failed[k] = v
-
-            if len(failed.keys()) > 0:
-                print(f'CRITICAL: outgoing HTTP request rate for {failed} req/sec.', perf_data)
-                sys.exit(nagios.CRITICAL)
-            print(f'OK: outgoing HTTP request rate is {outgoing_http_request_rate} req/sec.', perf_data)
-            sys.exit(nagios.OK)
-        except Exception as e:
-            print(f'UNKNOWN: failed to check outgoing HTTP request rate "{e}"')
-            print(traceback.format_exc())
-            sys.exit(nagios.UNKNOWN)
-    elif args.type == 'avg-send':
-        # Average send time in seconds
-        event_send_time_MAX = 1 if not args.crit else args.crit
-        try:
-            event_send_time = get_event_send_time(args.grafana_api_key, args.interval, args.range, args.grafana_server)
-            if event_send_time > event_send_time_MAX:
-                print(f"CRITICAL: average message send time is {event_send_time} sec. |'avg-send-time'={event_send_time}s;;;")
-                sys.exit(nagios.CRITICAL)
-            else:
-                print(f"OK: average message send time is {event_send_time} sec. |'avg-send-time'={event_send_time}s;;;")
-                sys.exit(nagios.OK)
-        except Exception as e:
-            print(f'UNKNOWN: failed to check average message send time "{e}"')
-            print(traceback.format_exc())
-            sys.exit(nagios.UNKNOWN)
-    elif args.type == 'db-lag':
-        # in seconds
-        db_lag_MAX = 0.01 if not args.crit else args.crit
+        check_response_time()
+    elif args.type in registry.checks():
         try:
-            db_lag = get_waiting_for_db(args.grafana_api_key, args.interval, args.range, args.grafana_server)
-            if db_lag > db_lag_MAX:
-                print(f"CRITICAL: DB lag is {db_lag} sec. |'db-lag'={db_lag}s;;;")
-                sys.exit(nagios.CRITICAL)
+            distribution = {}
+            if args.latency_distribution and registry.metrics[args.type].get('distribution'):
+                value, distribution = get_metric_distribution(datasource, args.type, args.interval, args.range, reduction=args.reduction, registry=registry)
+            elif cache:
+                # Fetch every metric so that checks of different types scheduled at the same time share one cache entry.
+                value = get_all(datasource, args.interval, args.range, types=registry.checks(), reduction=args.reduction, registry=registry)[args.type]
+                if isinstance(value, Exception):
+                    raise value
             else:
-                print(f"OK: DB lag is {db_lag} sec. |'db-lag'={db_lag}s;;;")
-                sys.exit(nagios.OK)
+                value = get_metric(datasource, args.type, args.interval, args.range, reduction=args.reduction, registry=registry)
+            code, text, perf_data = check_metric(args.type, value, args.warn, args.crit)
+            unit = registry.metrics[args.type]['unit']
+            if distribution:
+                text += '\n' + ', '.join(f'{k}: {v} sec.' for k, v in distribution.items())
+                perf_data = ' '.join([perf_data] + [f"'{k}'={v}{unit};;;" for k, v in distribution.items()])
+            print(text, f'|{perf_data}')
+            sys.exit(code)
         except Exception as e:
-            print(f'UNKNOWN: failed to check DB lag "{e}"')
+            print(f'UNKNOWN: failed to check {registry.metrics[args.type]["description"]} "{e}"')
             print(traceback.format_exc())
             sys.exit(nagios.UNKNOWN)
     else:
@@ -1,21 +1,19 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
-import json
 import os
 import sys
 import tempfile
 import traceback
 import urllib
 
-import numpy as np
 import requests
 from PIL import Image
-from nio import AsyncClient, AsyncClientConfig, LoginResponse, RoomSendError
+from nio import AsyncClient, AsyncClientConfig, LoginError, RoomSendError
 from urllib3.exceptions import InsecureRequestWarning
 
-from checker import nagios
-from checker.synapse_client import send_image, write_login_details_to_disk
+from checker import http_timing, nagios, token_cache
+from checker.synapse_client import send_image
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('--user', required=True, help='User ID for the bot.')
@@ -26,7 +24,7 @@ parser.add_argument('--room', required=True, help='The room the bot should send
 parser.add_argument('--check-domain', required=True, help='The domain that should be present.')
 parser.add_argument('--media-cdn-redirect', default='true', help='If set, the server must respond with a redirect to the media CDN domain.')
 parser.add_argument('--required-headers', nargs='*', help="If these headers aren't set to the correct value, critical. Use the format 'key=value")
-parser.add_argument('--auth-file', help="File to cache the bot's login details to.")
+parser.add_argument('--auth-file', help="File to cache the bot's login details to. Defaults to a file in ~/.cache/icinga2-checks/tokens.")
 parser.add_argument('--timeout', type=float, default=90, help='Request timeout limit.')
 parser.add_argument('--warn', type=float, default=2.0, help='Manually set warn level.')
 parser.add_argument('--crit', type=float, default=2.5, help='Manually set critical level.')
@@ -94,33 +92,15 @@ async def main() -> None:
             return f"WARN: failed to purge media for this user.\n{e}"
 
     client = AsyncClient(args.hs, args.user, config=AsyncClientConfig(request_timeout=args.timeout, max_timeout_retry_wait_time=10))
-    if args.auth_file:
-        # If there are no previously-saved credentials, we'll use the password
-        if not os.path.exists(args.auth_file):
-            resp = await client.login(args.pw)
-
-            # check that we logged in successfully
-            if isinstance(resp, LoginResponse):
-                write_login_details_to_disk(resp, args.hs, args.auth_file)
-            else:
-                print(f'CRITICAL: failed to log in.\n{resp}')
-                sys.exit(nagios.CRITICAL)
-        else:
-            # Otherwise the config file exists, so we'll use the stored credentials
-            with open(args.auth_file, "r") as f:
-                config = json.load(f)
-                client = AsyncClient(config["homeserver"])
-                client.access_token = config["access_token"]
-                client.user_id = config["user_id"]
-                client.device_id = config["device_id"]
-    else:
-        await client.login(args.pw)
+    resp = await token_cache.login(client, args.pw, args.auth_file)
+    if isinstance(resp, LoginError):
+        print(f'CRITICAL: failed to log in.\n{resp}')
+        sys.exit(nagios.CRITICAL)
 
     await client.join(args.room)
 
     # Create a random image
-    imarray = np.random.rand(100, 100, 3) * 255
-    im = Image.fromarray(imarray.astype('uint8')).convert('RGBA')
+    im = Image.frombytes('RGB', (100, 100), os.urandom(100 * 100 * 3)).convert('RGBA')
     _, test_image_path = tempfile.mkstemp()
     test_image_path = test_image_path + '.png'
     im.save(test_image_path)
@@ -141,16 +121,17 @@ async def main() -> None:
 
     # Check the headers. Ignore the non-async thing here, it doesn't
     # matter in this situation.
-    r = requests.head(target_file_url, allow_redirects=False)
+    r = http_timing.request('HEAD', target_file_url, timeout=args.timeout)
+    perf_data = [http_timing.timing_perfdata('media', [r.timing])]
 
     prints = []
 
-    if r.status_code != 200 and not args.media_cdn_redirect:
+    if r.status != 200 and not args.media_cdn_redirect:
         await cleanup(client, test_image_path, image_event_id=image_event_id)
-        prints.append(f'CRITICAL: status code is "{r.status_code}"')
+        prints.append(f'CRITICAL: status code is "{r.status}"')
         sys.exit(nagios.CRITICAL)
     else:
-        prints.append(f'OK: status code is "{r.status_code}"')
+        prints.append(f'OK: status code is "{r.status}"')
 
     headers = dict(r.headers)
 
@@ -168,9 +149,10 @@ async def main() -> None:
             prints.append(f'CRITICAL: was not redirected to the media CDN domain.')
 
         # Make sure we aren't redirected if we're a Synapse server
-        test = requests.head(target_file_url, headers={'User-Agent': 'Synapse/1.77.3'}, allow_redirects=False)
-        if test.status_code != 200:
-            prints.append('CRITICAL: Synapse user-agent is redirected with status code', test.status_code)
+        test = http_timing.request('HEAD', target_file_url, headers={'User-Agent': 'Synapse/1.77.3'}, timeout=args.timeout)
+        perf_data.append(http_timing.timing_perfdata('media-synapse-ua', [test.timing]))
+        if test.status != 200:
+            prints.append(f'CRITICAL: Synapse user-agent is redirected with status code {test.status}')
             exit_code = nagios.CRITICAL
         else:
             prints.append(f'OK: Synapse user-agent is not redirected.')
@@ -213,6 +195,7 @@ async def main() -> None:
 
     if clean_msg:
         print(clean_msg)
+    print(f'|{" ".join(perf_data)}')
 
     sys.exit(exit_code)
 
@@ -0,0 +1,161 @@
+import fcntl
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+
+@contextmanager
+def locked(path, shared=False, blocking=True):
+    """
+    Hold an flock() on `path` for the duration of the block. The lock is released automatically if the process dies.
+    With blocking=False BlockingIOError is raised if someone else holds the lock.
+    """
+    with open(path, 'a+') as f:
+        fcntl.flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield f
+        finally:
+            # Flush before unlocking or the next holder may read a half-written file.
+            f.flush()
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def atomic_write(path, data: bytes, fsync=False):
+    """
+    Write to a temp file in the same directory and rename it over `path` so readers never see a partial file.
+    With fsync=True the data is on disk before the rename, so the file survives a crash or power loss.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+# Temp files are written to as the response comes in, one that wasn't touched for this long belongs to a fetch that crashed.
+TMP_MAX_AGE = 3600
+
+
+class FileCache:
+    """
+    TTL cache of raw responses shared by every process that points at the same directory.
+
+    Entries are keyed on the normalized request and the current time bucket (now // ttl) so checks
+    scheduled in the same window share one fetch. A per-key flock() makes concurrent misses queue
+    behind the first fetcher and read its result instead of all hitting the backend.
+    """
+
+    def __init__(self, directory, ttl=30):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def make_key(self, *parts):
+        normalized = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+        bucket = int(time.time() // self.ttl)
+        return hashlib.sha256(f'{bucket}:{normalized}'.encode()).hexdigest()
+
+    def _fresh(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime < self.ttl
+        except FileNotFoundError:
+            return False
+
+    def get(self, key, fetch):
+        """
+        Return the cached bytes for `key`, calling `fetch()` to produce them on a miss.
+        """
+        with self.open(key, lambda f: f.write(fetch())) as f:
+            return f.read()
+
+    def open(self, key, fetch):
+        """
+        Like get() but returns an open binary file, and `fetch(f)` writes the response into `f` on a miss.
+        Large responses go straight to disk and can be decoded incrementally from there.
+        """
+        path = os.path.join(self.directory, f'{key}.cache')
+        if self._fresh(path):
+            self._count('hits')
+            return open(path, 'rb')
+
+        with locked(os.path.join(self.directory, f'{key}.lock')):
+            # Someone else may have fetched it while we were waiting for the lock.
+            if self._fresh(path):
+                self._count('coalesced')
+                return open(path, 'rb')
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    fetch(f)
+                os.replace(tmp, path)
+            except Exception:
+                os.unlink(tmp)
+                raise
+            f = open(path, 'rb')
+        self._count('misses')
+        self.evict()
+        return f
+
+    def evict(self):
+        """
+        Delete expired entries and their lock files, and the temp files of fetches that crashed halfway.
+        """
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                age = now - os.stat(path).st_mtime
+                if name.endswith('.cache') and age > self.ttl * 2:
+                    os.unlink(path)
+                elif name.endswith('.lock') and age > self.ttl * 2:
+                    # A lock file's mtime doesn't change while it is held. Leave it alone if a slow fetch still holds it,
+                    # or the checks waiting for that fetch and the ones that come after would lock different files.
+                    with locked(path, blocking=False):
+                        os.unlink(path)
+                elif name.startswith('.tmp-') and age > TMP_MAX_AGE:
+                    os.unlink(path)
+            except (FileNotFoundError, BlockingIOError):
+                pass
+
+    def _count(self, counter):
+        path = os.path.join(self.directory, 'stats.json')
+        with locked(path) as f:
+            f.seek(0)
+            try:
+                stats = json.load(f)
+            except ValueError:
+                stats = {}
+            stats[counter] = stats.get(counter, 0) + 1
+            f.seek(0)
+            f.truncate()
+            json.dump(stats, f)
+
+    def stats(self):
+        path = os.path.join(self.directory, 'stats.json')
+        if not os.path.exists(path):
+            return {}
+        with locked(path, shared=True) as f:
+            f.seek(0)
+            try:
+                return json.load(f)
+            except ValueError:
+                return {}
+
+
+if __name__ == '__main__':
+    # python3 -m checker.cache /path/to/cache-dir
+    stats = FileCache(sys.argv[1]).stats()
+    hits = stats.get('hits', 0) + stats.get('coalesced', 0)
+    total = hits + stats.get('misses', 0)
+    print(json.dumps(stats))
+    print(f'hit rate: {round(hits / total * 100, 1) if total else 0}%')
@@ -0,0 +1,113 @@
+import importlib
+import io
+import os
+import runpy
+import signal
+import socketserver
+import sys
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+
+from .daemon_client import DEFAULT_SOCKET, SCRIPTS_DIR, recv_line, send_line
+
+PRELOAD = [
+    'requests',
+    'urllib3',
+    'nio',
+    'aiohttp',
+    'PIL.Image',
+    'magic',
+    'markdown',
+    'ijson',
+    'checker.cache',
+    'checker.datasource',
+    'checker.registry',
+    'checker.synapse_grafana',
+    'checker.synapse_client',
+]
+
+
+def preload(modules=PRELOAD):
+    """
+    Import the modules the checks use so every forked check starts with them already loaded.
+    Missing optional dependencies are skipped.
+    """
+    loaded = []
+    for name in modules:
+        try:
+            importlib.import_module(name)
+            loaded.append(name)
+        except ImportError:
+            pass
+    return loaded
+
+
+def run_script(path, argv, cwd=None, timeout=None):
+    """
+    Run a check script as if it was started as `path argv...` and return (exit code, stdout, stderr).
+    Meant to be called in a forked child since the script parses its arguments and sets up globals at import time.
+    """
+    stdout, stderr = io.StringIO(), io.StringIO()
+
+    def on_timeout(signum, frame):
+        raise TimeoutError(f'check did not finish within {timeout} seconds')
+
+    if timeout:
+        signal.signal(signal.SIGALRM, on_timeout)
+        signal.alarm(timeout)
+    code = 0
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            if cwd:
+                os.chdir(cwd)
+            sys.argv = [path] + argv
+            runpy.run_path(path, run_name='__main__')
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                # sys.exit('message') prints the message and exits with 1, argparse errors are exit code 2.
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException as e:
+            print(f'UNKNOWN: exception "{e}"')
+            print(traceback.format_exc())
+            code = -1
+        finally:
+            signal.alarm(0)
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+class CheckHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        request = recv_line(self.request)
+        if not request:
+            return
+        script = os.path.basename(request['script'])
+        path = os.path.join(self.server.scripts_dir, script)
+        if not script.endswith('.py') or not os.path.isfile(path):
+            send_line(self.request, {'code': -1, 'stdout': f'UNKNOWN: no such check "{script}"\n', 'stderr': ''})
+            return
+        code, stdout, stderr = run_script(path, request.get('argv', []), request.get('cwd'), self.server.check_timeout)
+        send_line(self.request, {'code': code, 'stdout': stdout, 'stderr': stderr})
+
+
+class CheckServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """
+    Runs check scripts in forked children of a process that has already imported their dependencies,
+    so a check doesn't pay for interpreter startup and imports. Each check runs in its own child
+    and can't leak state into the next one.
+    """
+    block_on_close = False
+
+    def __init__(self, socket_path, scripts_dir=SCRIPTS_DIR, check_timeout=None, max_children=100):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.scripts_dir = scripts_dir
+        # Not `timeout`, that's socketserver's timeout for handle_request().
+        self.check_timeout = check_timeout
+        self.max_children = max_children
+        super().__init__(socket_path, CheckHandler)
+        os.chmod(socket_path, 0o660)
@@ -0,0 +1,46 @@
+import json
+import os
+import socket
+
+# The client side of checker.daemon. Only imports what it needs so check_client.py starts as fast as possible.
+
+DEFAULT_SOCKET = '/run/icinga2-checks/checks.sock'
+DEFAULT_TIMEOUT = 150  # Longer than the daemon's own --timeout for a check
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class DaemonUnavailable(Exception):
+    pass
+
+
+def recv_line(sock):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    return json.loads(data) if data else None
+
+
+def send_line(sock, obj):
+    sock.sendall(json.dumps(obj).encode() + b'\n')
+
+
+def run_check(socket_path, script, argv, timeout=None):
+    """
+    Ask the daemon at `socket_path` to run `script` with `argv`. Returns (exit code, stdout, stderr).
+    Raises DaemonUnavailable if connecting failed (not running, no permission, ...), the daemon never saw the request then.
+    An OSError (including a timeout) happened after the request was sent, so the daemon may have run the check already.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+        except OSError as e:
+            raise DaemonUnavailable(e) from e
+        send_line(sock, {'script': script, 'argv': argv, 'cwd': os.getcwd()})
+        response = recv_line(sock)
+    if response is None:
+        raise ConnectionError('daemon closed the connection without a result')
+    return response['code'], response['stdout'], response['stderr']
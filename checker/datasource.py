@@ -0,0 +1,141 @@
+import hashlib
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from urllib3.exceptions import InsecureRequestWarning
+
+from .frames import QueryError, decode_grafana, decode_prometheus
+
+requests.packages.urllib3.disable_warnings(category=InsecureRequestWarning)
+
+
+class Datasource:
+    """
+    Where the metrics come from. query_stats() takes a list of checker.registry.Query and returns a dict of
+    refId -> list of series.
+    Each series is a dict with:
+        name -- Prometheus-style series name, e.g. '{job="synapse", method="GET"}'
+        labels -- dict of the series labels
+        stats -- a RunningStats of the series' values, null and NaN points are counted as nulls
+    A query that failed maps to a QueryError instead of a list so the other queries in the batch are still usable.
+    Implementations stream the response into the stats so memory use doesn't grow with the range.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+
+    def _open(self, key_parts, request):
+        """
+        Return a binary file object with the response body. `request()` must return a streaming requests.Response.
+        """
+        if self.cache:
+            def fetch(f):
+                for chunk in request().iter_content(chunk_size=65536):
+                    f.write(chunk)
+
+            return self.cache.open(self.cache.make_key(*key_parts), fetch)
+        r = request()
+        r.raw.decode_content = True
+        return r.raw
+
+
+class GrafanaDatasource(Datasource):
+    """
+    Query Prometheus through Grafana's /api/ds/query proxy.
+    datasource_uid is the UID of the Prometheus datasource in Grafana.
+    """
+
+    def __init__(self, endpoint, api_key, datasource_uid, cache=None):
+        super().__init__(cache)
+        self.endpoint = endpoint
+        self.api_key = api_key
+        self.datasource_uid = datasource_uid
+
+    def to_grafana(self, query):
+        q = {
+            'datasource': {
+                'type': 'prometheus',
+                'uid': self.datasource_uid,
+            },
+            'expr': query.expr,
+            'format': 'time_series',
+            'intervalFactor': query.interval_factor,
+            'refId': query.ref_id,
+            'interval': '',
+            'instant': query.instant,
+            'range': query.range,
+            'queryType': 'timeSeriesQuery',
+            'exemplar': False,
+            'legendFormat': '',
+            'intervalMs': query.interval_ms,
+        }
+        if query.max_data_points:
+            q['maxDataPoints'] = query.max_data_points
+        return q
+
+    def _open_query(self, queries, data_range):
+        json_data = {
+            'queries': [self.to_grafana(q) for q in queries],
+            'from': f'now-{data_range}m',
+            'to': 'now',
+        }
+
+        def request():
+            r = requests.post(f'{self.endpoint}/api/ds/query', headers={'Authorization': f'Bearer {self.api_key}'}, json=json_data, verify=False, stream=True)
+            r.raise_for_status()
+            return r
+
+        return self._open((self.endpoint, hashlib.sha256(self.api_key.encode()).hexdigest(), json_data), request)
+
+    def query_stats(self, queries, data_range, quantiles=()):
+        with self._open_query(queries, data_range) as f:
+            return decode_grafana(f, quantiles)
+
+class PrometheusDatasource(Datasource):
+    """
+    Query Prometheus directly through /api/v1/query_range, or /api/v1/query for instant-only queries.
+    Prometheus has no batch endpoint so the queries are sent in parallel.
+    """
+
+    def __init__(self, endpoint, headers=None, cache=None):
+        super().__init__(cache)
+        self.endpoint = endpoint.rstrip('/')
+        self.headers = headers or {}
+
+    def _open_query(self, query, data_range):
+        step = query.interval_ms * query.interval_factor / 1000
+        # Align to the step so concurrent checks send identical requests and can share a cache entry.
+        end = math.floor(time.time() / step) * step
+        if query.instant and not query.range:
+            url = f'{self.endpoint}/api/v1/query'
+            params = {'query': query.expr, 'time': end}
+        else:
+            url = f'{self.endpoint}/api/v1/query_range'
+            params = {'query': query.expr, 'start': end - data_range * 60, 'end': end, 'step': step}
+
+        def request():
+            r = requests.post(url, data=params, headers=self.headers, verify=False, stream=True)
+            r.raise_for_status()
+            return r
+
+        return self._open((url, params), request)
+
+    def _query_one_stats(self, query, data_range, quantiles):
+        with self._open_query(query, data_range) as f:
+            return decode_prometheus(f, quantiles)
+
+    def query_stats(self, queries, data_range, quantiles=()):
+        return self._parallel(self._query_one_stats, queries, data_range, quantiles)
+
+    def _parallel(self, func, queries, *args):
+        with ThreadPoolExecutor(max_workers=max(len(queries), 1)) as executor:
+            futures = {q.ref_id: executor.submit(func, q, *args) for q in queries}
+        output = {}
+        for ref_id, future in futures.items():
+            try:
+                output[ref_id] = future.result()
+            except Exception as e:
+                output[ref_id] = e if isinstance(e, QueryError) else QueryError(f'Prometheus query {ref_id} failed: {e}')
+        return output
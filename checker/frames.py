@@ -0,0 +1,236 @@
+import json
+import math
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+class QueryError(Exception):
+    pass
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate with constant memory (the P-square algorithm, Jain & Chlamtac 1985).
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self._initial = []
+        self._heights = None
+        self._positions = None
+        self._desired = None
+        self._increments = None
+
+    def add(self, x):
+        if self._initial is not None:
+            self._initial.append(x)
+            if len(self._initial) == 5:
+                p = self.p
+                self._heights = sorted(self._initial)
+                self._positions = [1, 2, 3, 4, 5]
+                self._desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+                self._increments = [0, p / 2, p, (1 + p) / 2, 1]
+                self._initial = None
+            return
+
+        q, n = self._heights, self._positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while not q[k] <= x < q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if q[i - 1] < parabolic < q[i + 1]:
+                    q[i] = parabolic
+                else:
+                    q[i] = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                n[i] += d
+
+    def value(self):
+        if self._initial is not None:
+            if not self._initial:
+                return None
+            values = sorted(self._initial)
+            return values[round(self.p * (len(values) - 1))]
+        return self._heights[2]
+
+
+class RunningStats:
+    """
+    Mean/min/max/stddev and optional quantile estimates of a series, updated one value at a time.
+    None and NaN are counted as nulls and otherwise ignored.
+    """
+
+    def __init__(self, quantiles=()):
+        self.count = 0
+        self.nulls = 0
+        self.mean = None
+        self.min = None
+        self.max = None
+        self._m2 = 0.0
+        self._quantiles = {q: P2Quantile(q) for q in quantiles}
+
+    def add(self, value):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            self.nulls += 1
+            return
+        self.count += 1
+        if self.count == 1:
+            self.mean = self.min = self.max = value
+        else:
+            # Welford's algorithm
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (value - self.mean)
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+        for estimator in self._quantiles.values():
+            estimator.add(value)
+
+    @property
+    def stddev(self):
+        return math.sqrt(self._m2 / self.count) if self.count else None
+
+    def quantile(self, q):
+        return self._quantiles[q].value()
+
+
+def _walk(obj, prefix=''):
+    """
+    Yield ijson.parse()-style events for an already decoded object.
+    """
+    if isinstance(obj, dict):
+        yield prefix, 'start_map', None
+        for k, v in obj.items():
+            yield prefix, 'map_key', k
+            yield from _walk(v, f'{prefix}.{k}' if prefix else k)
+        yield prefix, 'end_map', None
+    elif isinstance(obj, list):
+        yield prefix, 'start_array', None
+        for v in obj:
+            yield from _walk(v, f'{prefix}.item' if prefix else 'item')
+        yield prefix, 'end_array', None
+    elif obj is None:
+        yield prefix, 'null', None
+    elif isinstance(obj, bool):
+        yield prefix, 'boolean', obj
+    elif isinstance(obj, (int, float)):
+        yield prefix, 'number', obj
+    else:
+        yield prefix, 'string', obj
+
+
+def parse_events(f):
+    """
+    Incrementally parse a JSON file object into (prefix, event, value) tuples.
+    Uses ijson when it is installed; otherwise the whole document is loaded first so memory is no longer constant.
+    """
+    if ijson:
+        return ijson.parse(f, use_float=True)
+    return _walk(json.load(f))
+
+
+def decode_grafana(f, quantiles=()):
+    """
+    Stream a Grafana /api/ds/query response into running stats, one sample at a time.
+    Returns refId -> list of {'name', 'labels', 'stats'}, or a QueryError for queries Grafana reported as failed.
+    """
+    output = {}
+    frame = None
+    add = None
+    column = -1
+    for prefix, event, value in parse_events(f):
+        # Hot path: a timestamp or a sample in the current frame.
+        if (event == 'number' or event == 'null') and prefix.endswith('.data.values.item.item'):
+            if add:
+                add(value)
+            continue
+        if not prefix.startswith('results.'):
+            continue
+        parts = prefix.split('.')
+        ref_id, rest = parts[1], parts[2:]
+        if rest == ['error'] and event == 'string':
+            output[ref_id] = QueryError(f'Grafana query {ref_id} failed: {value}')
+        elif rest == ['frames', 'item']:
+            if event == 'start_map':
+                frame = {'name': None, 'labels': {}, 'stats': RunningStats(quantiles)}
+                column = -1
+            elif event == 'end_map' and not isinstance(output.get(ref_id), QueryError):
+                output.setdefault(ref_id, []).append(frame)
+        elif rest == ['frames', 'item', 'schema', 'name'] and event == 'string':
+            frame['name'] = value
+        elif len(rest) == 7 and rest[:6] == ['frames', 'item', 'schema', 'fields', 'item', 'labels'] and event in ('string', 'number'):
+            frame['labels'][rest[6]] = value
+        elif rest == ['frames', 'item', 'data', 'values', 'item']:
+            # values[0] is the timestamps, values[1] the samples
+            if event == 'start_array':
+                column += 1
+                add = frame['stats'].add if column == 1 else None
+            elif event == 'end_array':
+                add = None
+    for series in output.values():
+        if isinstance(series, list):
+            for frame in series:
+                if not frame['name']:
+                    frame['name'] = series_name(frame['labels'])
+    return output
+
+
+def decode_prometheus(f, quantiles=()):
+    """
+    Stream a Prometheus /api/v1/query or /api/v1/query_range response into running stats.
+    Returns a list of {'name', 'labels', 'stats'}, one per series.
+    """
+    output = []
+    series = None
+    status = error = None
+    index = -1
+    for prefix, event, value in parse_events(f):
+        if prefix == 'status' and event == 'string':
+            status = value
+        elif prefix == 'error' and event == 'string':
+            error = value
+        elif prefix == 'data.result.item':
+            if event == 'start_map':
+                series = {'metric': {}, 'stats': RunningStats(quantiles)}
+            elif event == 'end_map':
+                output.append(series)
+        elif prefix.startswith('data.result.item.metric.') and event == 'string':
+            series['metric'][prefix[len('data.result.item.metric.'):]] = value
+        elif prefix in ('data.result.item.values.item', 'data.result.item.value') and event == 'start_array':
+            # Each sample is [timestamp, "value"]
+            index = -1
+        elif prefix in ('data.result.item.values.item.item', 'data.result.item.value.item'):
+            index += 1
+            if index == 1:
+                series['stats'].add(float(value) if value is not None else None)
+    if status != 'success':
+        raise QueryError(f'Prometheus query failed: {error}')
+    for series in output:
+        metric = series.pop('metric')
+        series['labels'] = {k: v for k, v in metric.items() if k != '__name__'}
+        series['name'] = metric.get('__name__', '') + series_name(series['labels'])
+    return output
+
+
+def series_name(labels):
+    return '{' + ', '.join(f'{k}="{v}"' for k, v in sorted(labels.items())) + '}'
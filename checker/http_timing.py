@@ -0,0 +1,159 @@
+import http.client
+import socket
+import ssl
+import time
+import urllib.parse
+from typing import NamedTuple, Optional
+
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'transfer')
+
+
+class Timing(NamedTuple):
+    """
+    How long each phase of a request took, in seconds. dns, connect and tls are None if the request
+    reused an open connection, tls is also None for plain HTTP. ttfb is from sending the request until
+    the response headers arrived and transfer is reading the body.
+    """
+    dns: Optional[float]
+    connect: Optional[float]
+    tls: Optional[float]
+    ttfb: float
+    transfer: float
+
+    @property
+    def total(self):
+        return sum(x for x in self if x is not None)
+
+
+class Response(NamedTuple):
+    status: int
+    headers: http.client.HTTPMessage
+    body: bytes
+    timing: Timing
+
+
+class TimedConnection:
+    """
+    A keep-alive HTTP(S) connection that times every phase of its requests. Not thread safe, use one per thread.
+    """
+
+    def __init__(self, url, timeout=10, verify=True):
+        parsed = urllib.parse.urlsplit(url)
+        self.https = parsed.scheme == 'https'
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 80)
+        self.timeout = timeout
+        self.context = ssl.create_default_context()
+        if not verify:
+            self.context.check_hostname = False
+            self.context.verify_mode = ssl.CERT_NONE
+        self._conn = None
+
+    def _connect(self):
+        start = time.perf_counter()
+        addresses = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+        sock = self._open(addresses)
+        try:
+            connected = time.perf_counter()
+            tls = None
+            if self.https:
+                sock = self.context.wrap_socket(sock, server_hostname=self.host)
+                tls = time.perf_counter() - connected
+        except Exception:
+            sock.close()
+            raise
+        if self.https:
+            self._conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=self.context)
+        else:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        # The handshake is already done, http.client won't connect again while sock is set.
+        self._conn.sock = sock
+        return resolved - start, connected - resolved, tls
+
+    def _open(self, addresses):
+        """
+        Connect to the first address that accepts, like socket.create_connection, so a host with
+        a broken IPv6 route still works over IPv4. The connect phase includes the failed attempts.
+        """
+        error = None
+        for family, type_, proto, _, address in addresses:
+            sock = socket.socket(family, type_, proto)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(address)
+                return sock
+            except OSError as e:
+                sock.close()
+                error = e
+        raise error
+
+    def request(self, method, url, headers=None, body=None):
+        """
+        Send a request for `url` (a full URL or a path on this host). Redirects are not followed.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        path = urllib.parse.urlunsplit(('', '', parsed.path or '/', parsed.query, ''))
+        reused = self._conn is not None
+        try:
+            return self._request(method, path, headers, body)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            if not reused:
+                raise
+            # The server closed the idle connection, try once more on a new one.
+            self.close()
+            return self._request(method, path, headers, body)
+
+    def _request(self, method, path, headers, body):
+        dns = connect = tls = None
+        if self._conn is None:
+            dns, connect, tls = self._connect()
+        try:
+            start = time.perf_counter()
+            self._conn.request(method, path, body=body, headers=headers or {})
+            response = self._conn.getresponse()
+            headers_received = time.perf_counter()
+            data = response.read()
+            done = time.perf_counter()
+        except Exception:
+            self.close()
+            raise
+        if response.will_close:
+            self.close()
+        return Response(response.status, response.headers, data, Timing(dns, connect, tls, headers_received - start, done - headers_received))
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def request(method, url, headers=None, body=None, timeout=10, verify=True):
+    """
+    One request on a new connection, like requests.request(..., allow_redirects=False) but with the per-phase timing.
+    """
+    conn = TimedConnection(url, timeout=timeout, verify=verify)
+    try:
+        return conn.request(method, url, headers, body)
+    finally:
+        conn.close()
+
+
+def summarize_phases(timings):
+    """
+    Mean duration of each phase over the requests that went through it.
+    A phase no request went through (e.g. tls on plain HTTP) is left out.
+    """
+    output = {}
+    for phase in PHASES:
+        values = [getattr(t, phase) for t in timings if getattr(t, phase) is not None]
+        if values:
+            output[phase] = sum(values) / len(values)
+    return output
+
+
+def timing_perfdata(label, timings):
+    """
+    Perfdata with one series per phase, e.g. 'label-dns'=0.002s;;;
+    """
+    return ' '.join(f"'{label}-{phase}'={round(value, 4)}s;;;" for phase, value in summarize_phases(timings).items())
@@ -0,0 +1,174 @@
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urljoin
+
+EVENT_TYPES = ['CheckResult', 'StateChange', 'AcknowledgementSet', 'AcknowledgementCleared']
+
+
+def match(pattern):
+    """
+    A function telling if a name matches `pattern` like Icinga2's match() does: `*` and `?` are wildcards, everything else is literal.
+    """
+    regex = re.compile('.*'.join('.'.join(re.escape(part) for part in chunk.split('?')) for chunk in pattern.split('*')), re.DOTALL)
+    return lambda name: regex.fullmatch(name) is not None
+
+
+class StateIndex:
+    """
+    Every host and service object from the Icinga2 API, kept up to date from the /v1/events stream so lookups don't
+    have to ask Icinga2. A full resync every `resync_interval` seconds heals anything the stream missed.
+    The stream is reconnected (and the index resynced) when nothing arrives for `stream_timeout` seconds, so a dead
+    connection doesn't leave the index stale. The objects look the same as what client.objects.list() returns.
+    """
+
+    def __init__(self, client, resync_interval=300, stream_timeout=120):
+        self.client = client
+        self.resync_interval = resync_interval
+        self.stream_timeout = stream_timeout
+        self.resync_now = threading.Event()
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.services = {}  # host name -> {full service name: object}
+        self.synced = 0  # When the last resync finished
+        self.streaming = False
+        self.resyncing = False
+        self.missed = []  # Events that arrived while a resync was running
+        self.pid = None
+
+    def start(self):
+        """
+        Start the stream and resync threads, unless this process already has them.
+        Safe to call on every request, threads don't survive a fork so gunicorn workers each start their own.
+        """
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+        threading.Thread(target=self._stream, daemon=True).start()
+        threading.Thread(target=self._resync_loop, daemon=True).start()
+
+    def ready(self):
+        # Without the stream, or if resyncing keeps failing, the index may be out of date.
+        return self.streaming and time.time() - self.synced < self.resync_interval * 2
+
+    def lookup(self, pattern):
+        """
+        The host objects matching `pattern` (an Icinga2 match() pattern like in the API filters) and their service objects.
+        """
+        with self.lock:
+            if '*' in pattern or '?' in pattern:
+                names = list(filter(match(pattern), self.hosts))
+            else:
+                names = [pattern] if pattern in self.hosts else []
+            return [self.hosts[name] for name in names], [service for name in names for service in self.services.get(name, {}).values()]
+
+    def resync(self):
+        with self.lock:
+            self.resyncing = True
+            self.missed = []
+        try:
+            hosts = {obj['name']: obj for obj in self.client.objects.list('Host')}
+            services = {}
+            for obj in self.client.objects.list('Service'):
+                services.setdefault(obj['attrs']['host_name'], {})[obj['name']] = obj
+        except Exception:
+            with self.lock:
+                self.resyncing = False
+                self.missed = []
+            raise
+        # All in one go, or an event applied in between would go to the old dicts and be lost.
+        with self.lock:
+            self.resyncing = False
+            self.hosts, self.services = hosts, services
+            # Events that came in while we were fetching may be newer than what we got.
+            for event in self.missed:
+                self._apply(event)
+            self.missed = []
+            self.synced = time.time()
+
+    def apply(self, event):
+        with self.lock:
+            if self.resyncing:
+                self.missed.append(event)
+            self._apply(event)
+
+    def _apply(self, event):
+        if event.get('service'):
+            obj = self.services.get(event['host'], {}).get(f'{event["host"]}!{event["service"]}')
+        else:
+            obj = self.hosts.get(event.get('host'))
+        if obj is None:
+            # A new object, the next resync picks it up.
+            return
+        # Replace attrs instead of changing it so a request that is serializing the object right now isn't affected.
+        attrs = obj['attrs'] = dict(obj['attrs'])
+        timestamp = event.get('timestamp', 0)
+
+        if event['type'] in ('CheckResult', 'StateChange'):
+            if timestamp < attrs.get('last_check', 0):
+                # Older than what we already have, e.g. replayed after a resync.
+                return
+            if event['type'] == 'StateChange':
+                attrs['state'] = event['state']
+            else:
+                state = event['check_result']['state']
+                # Host check results use the service states, OK and WARNING mean the host is UP.
+                attrs['state'] = state if event.get('service') else (0 if state <= 1 else 1)
+            attrs['last_check'] = timestamp
+            if 'acknowledgement' in event:
+                if not event['acknowledgement']:
+                    attrs['acknowledgement'] = 0
+                    attrs['acknowledgement_expiry'] = 0
+                elif not attrs.get('acknowledgement'):
+                    attrs['acknowledgement'] = 1
+        elif event['type'] == 'AcknowledgementSet':
+            attrs['acknowledgement'] = event.get('acknowledgement_type', 1)
+            attrs['acknowledgement_expiry'] = event.get('expiry', 0)
+        elif event['type'] == 'AcknowledgementCleared':
+            attrs['acknowledgement'] = 0
+            attrs['acknowledgement_expiry'] = 0
+
+    def _connect(self):
+        # icinga2api's events.subscribe() reads the stream a byte at a time and compares bytes to str, and its _request()
+        # can't set a timeout. Use its session for the auth and certificates like every other call, but do the request ourselves.
+        manager = self.client.events.manager
+        session = self.client.events._create_session('POST')
+        response = session.post(urljoin(manager.url, 'v1/events'), json={'types': EVENT_TYPES, 'queue': f'icinga2kuma-{os.getpid()}'},
+                                verify=manager.ca_certificate or False, stream=True, timeout=(10, self.stream_timeout))
+        response.raise_for_status()
+        return response
+
+    def _stream(self):
+        delay = 1
+        connected_before = False
+        while True:
+            try:
+                response = self._connect()
+                if connected_before:
+                    # Whatever happened while we were disconnected is only in a full resync.
+                    self.resync_now.set()
+                connected_before = True
+                self.streaming = True
+                delay = 1
+                # A read that waits longer than stream_timeout raises, a connection that died without closing doesn't hang here forever.
+                for line in response.iter_lines():
+                    if line:
+                        self.apply(json.loads(line))
+            except Exception as e:
+                print(f'icinga2kuma: event stream failed, falling back to the API: {e}')
+            self.streaming = False
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def _resync_loop(self):
+        while True:
+            self.resync_now.clear()
+            try:
+                self.resync()
+                self.resync_now.wait(self.resync_interval)
+            except Exception as e:
+                print(f'icinga2kuma: resync failed: {e}')
+                self.resync_now.wait(min(self.resync_interval, 30))
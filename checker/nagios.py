@@ -2,3 +2,12 @@ UNKNOWN = -1
 OK = 0
 WARNING = 1
 CRITICAL = 2
+
+
+def worst(a, b):
+    """
+    The more severe of two exit codes. UNKNOWN is -1, so it outranks OK but never a real problem.
+    """
+    if a == UNKNOWN and b == OK or b == UNKNOWN and a == OK:
+        return UNKNOWN
+    return max(a, b)
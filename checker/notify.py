@@ -1,3 +1,5 @@
+import html
+
 warn_ico = "⚠"
 error_ico = "❌"
 ok_ico = "✅"
@@ -70,3 +72,78 @@ def build_msg(host_name, host_display_name, state, date_str, output, service_nam
 **When:** {date_str}. <br>
 **Info:** {newline_to_formatted_html(output)}{address}{comment}{icinga2_url}"""
     return msg
+
+
+def html_block(string):
+    # Like newline_to_formatted_html() for text that still has to be escaped.
+    string = html.escape(string)
+    if '\n' in string:
+        string = f'<br><pre>{string}</pre>'
+    return string
+
+
+def quick_link(icinga2_url, host_name, service_name=None):
+    icinga2_url = icinga2_url.strip("/")
+    if service_name:
+        return f'{icinga2_url}/icingadb/service?name={service_name.replace(" ", "%20")}&host.name={host_name.replace(" ", "%20")}'
+    return f'{icinga2_url}/icingadb/host?name={host_name.replace(" ", "+")}'
+
+
+def build_content(host_name, host_display_name, state, date_str, output, service_name=None, service_display_name='', address='', comment='', author='', icinga2_url=''):
+    """
+    The Matrix message for a notification, the same as build_msg() but rendered straight to HTML instead of going through markdown.
+    Everything that comes from Icinga2 is escaped. The plain text body is for clients and push notifications that don't show HTML.
+    """
+    if service_name:
+        item = f'<strong>{html.escape(service_display_name)}</strong> on <strong>{html.escape(host_display_name)}</strong>'
+        item_text = f'{service_display_name} on {host_display_name}'
+        icon = service_ico
+    else:
+        item = f'<strong>{html.escape(host_display_name)}</strong>'
+        item_text = host_display_name
+        icon = host_ico
+
+    extra = extra_text = ''
+    if address:
+        extra += f'<br><strong>IP:</strong> {html.escape(address)}'
+        extra_text += f'\nIP: {address}'
+    if comment and author:
+        extra += f'<br><strong>Comment by {html.escape(author)}:</strong> {html_block(comment)}'
+        extra_text += f'\nComment by {author}: {comment}'
+    if icinga2_url and (service_name or host_name):
+        link = quick_link(icinga2_url, host_name, service_name)
+        extra += f'<br><a href="{html.escape(link)}">Quick Link</a>'
+        extra_text += f'\n{link}'
+
+    formatted_body = f"""{choose_icon(state)}&nbsp;&nbsp;{icon}&nbsp;&nbsp;&nbsp;{item} is <strong><font color="{choose_color(state)}">{html.escape(state)}</font></strong> <br>
+<strong>When:</strong> {html.escape(date_str)}. <br>
+<strong>Info:</strong> {html_block(output)}{extra}"""
+    body = f"""{choose_icon(state)} {icon} {item_text} is {state}
+When: {date_str}.
+Info: {output}{extra_text}"""
+    return {'msgtype': 'm.text', 'body': body, 'format': 'org.matrix.custom.html', 'formatted_body': formatted_body}
+
+
+def build_digest(host_name, host_display_name, state, services, icinga2_url=''):
+    """
+    One message for several services of a host that went into the same state, with the services in a collapsible list.
+    `services` is a list of dicts with service_name, service_display_name, output and date_str, oldest first.
+    Returns the Matrix message content like build_content().
+    """
+    items = []
+    lines = []
+    for service in services:
+        link = ''
+        if icinga2_url:
+            link = f' <a href="{html.escape(quick_link(icinga2_url, host_name, service["service_name"]))}">Quick Link</a>'
+        items.append(f'<li><strong>{html.escape(service["service_display_name"])}</strong>: {html_block(service["output"])}{link}</li>')
+        lines.append(f'- {service["service_display_name"]}: {service["output"]}')
+    when = services[0]['date_str'] if services[0]['date_str'] == services[-1]['date_str'] else f'{services[0]["date_str"]} to {services[-1]["date_str"]}'
+
+    formatted_body = f"""{choose_icon(state)}&nbsp;&nbsp;{service_ico}&nbsp;&nbsp;&nbsp;<strong>{len(services)} services</strong> on <strong>{html.escape(host_display_name)}</strong> are <strong><font color="{choose_color(state)}">{html.escape(state)}</font></strong> <br>
+<strong>When:</strong> {html.escape(when)}. <br>
+<details><summary>Services</summary><ul>{''.join(items)}</ul></details>"""
+    body = f"""{choose_icon(state)} {service_ico} {len(services)} services on {host_display_name} are {state}
+When: {when}.
+""" + '\n'.join(lines)
+    return {'msgtype': 'm.text', 'body': body, 'format': 'org.matrix.custom.html', 'formatted_body': formatted_body}
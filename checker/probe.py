@@ -0,0 +1,79 @@
+import asyncio
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from .http_timing import TimedConnection
+
+
+def percentile(values, p):
+    """
+    Linear-interpolated percentile of an already sorted list, p in [0, 1].
+    """
+    if not values:
+        return None
+    k = (len(values) - 1) * p
+    lower, upper = math.floor(k), math.ceil(k)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def summarize(times):
+    """
+    min/p50/p95/max/mean/stddev of a list of durations in seconds.
+    """
+    times = sorted(times)
+    if not times:
+        return {}
+    mean = sum(times) / len(times)
+    return {
+        'min': times[0],
+        'p50': percentile(times, 0.5),
+        'p95': percentile(times, 0.95),
+        'max': times[-1],
+        'mean': mean,
+        'stddev': math.sqrt(sum((x - mean) ** 2 for x in times) / len(times)),
+    }
+
+
+async def probe_async(url, samples=10, concurrency=5, pacing=0.1, reuse_connections=True, timeout=10, method='POST', verify_ssl=False):
+    """
+    Time `samples` requests to `url`. A new request is started every `pacing` seconds with at most `concurrency` in flight,
+    so a healthy run takes about samples * pacing seconds instead of running them back to back.
+    With reuse_connections=False every request opens a new connection, so the times include the TCP and TLS handshake.
+    Returns a list with the Timing (see checker.http_timing) of each request, or the exception it failed with.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    # Open connections not in use by a request. The requests run in threads since http_timing is blocking.
+    idle = []
+
+    def send():
+        try:
+            conn = idle.pop()
+        except IndexError:
+            conn = TimedConnection(url, timeout=timeout, verify=verify_ssl)
+        try:
+            return conn.request(method, url).timing
+        finally:
+            if reuse_connections:
+                idle.append(conn)
+            else:
+                conn.close()
+
+    async def one(i):
+        await asyncio.sleep(i * pacing)
+        async with semaphore:
+            try:
+                return await loop.run_in_executor(executor, send)
+            except Exception as e:
+                return e
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        try:
+            return await asyncio.gather(*(one(i) for i in range(samples)))
+        finally:
+            for conn in idle:
+                conn.close()
+
+
+def probe(url, **kwargs):
+    return asyncio.run(probe_async(url, **kwargs))
@@ -0,0 +1,130 @@
+import json
+import os
+from functools import lru_cache
+from string import Template
+from typing import NamedTuple, Optional
+
+DEFAULT_METRICS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.json')
+
+
+class Query(NamedTuple):
+    """
+    One PromQL query, independent of the datasource it is sent to. Hashable so it can be batched, cached and compared.
+    """
+    ref_id: str
+    expr: str
+    interval_ms: int
+    interval_factor: int = 1
+    instant: bool = False
+    range: bool = True
+    max_data_points: Optional[int] = None
+
+
+def _series_mean(series, metric):
+    if not series or not series[0]['stats'].count:
+        # A metric with "no_data" expects gaps, e.g. the send time is 0/0 = NaN when nothing was sent during the range.
+        if 'no_data' in metric:
+            return metric['no_data']
+        raise ValueError('no data')
+    return series[0]['stats'].mean
+
+
+def reduce_mean(metric, results):
+    # Mean of the first series of the metric's value query.
+    return round(_series_mean(results[metric['ref']], metric), metric['round'])
+
+
+def reduce_max(metric, results):
+    # Worst value of the first series of the metric's value query over the range.
+    series = results[metric['ref']]
+    if not series or not series[0]['stats'].count:
+        raise ValueError('no data')
+    return round(series[0]['stats'].max, metric['round'])
+
+
+def reduce_mean_of_series(metric, results):
+    # Mean of the per-series means. Series that are all null are skipped.
+    means = [s['stats'].mean for s in results[metric['ref']] if s['stats'].count > 0]
+    if not means:
+        raise ValueError('no data')
+    return round(sum(means) / len(means), metric['round'])
+
+
+def reduce_mean_by_query(metric, results):
+    # Mean of the first series of every query, keyed by the last label in the series name (e.g. the HTTP method).
+    output = {}
+    for ref_id, series in results.items():
+        name = series[0]['name'].split('=')[-1].strip('}').strip('"')
+        output[name] = round(_series_mean(series, metric), metric['round'])
+    return output
+
+
+REDUCTIONS = {
+    'mean': reduce_mean,
+    'mean-of-series': reduce_mean_of_series,
+    'mean-by-query': reduce_mean_by_query,
+    'max': reduce_max,
+}
+
+# The PromQL function that does the same thing as a reduction when reduction='server'.
+SERVER_REDUCTIONS = {
+    'max': 'max_over_time',
+}
+
+
+class Registry:
+    """
+    The metrics described in a metrics file (see checker/metrics.json). Each metric has its PromQL
+    queries, written with $selector placeholders, how to reduce the results to one value, and its thresholds.
+    """
+
+    def __init__(self, definition, **selectors):
+        self.grafana_datasource_uid = definition.get('grafana_datasource_uid')
+        self.metrics = definition['metrics']
+        self.selectors = {**definition.get('selectors', {}), **{k: v for k, v in selectors.items() if v}}
+        # Selectors may refer to each other, e.g. $workers is built from $instance and $jobs.
+        for _ in range(len(self.selectors)):
+            self.selectors = {k: Template(v).safe_substitute(self.selectors) for k, v in self.selectors.items()}
+        for name, metric in self.metrics.items():
+            metric.setdefault('ref', metric['queries'][0]['ref'])
+
+    def checks(self):
+        """
+        Names of the metrics that have thresholds, i.e. can be checked.
+        """
+        return [name for name, metric in self.metrics.items() if 'crit' in metric]
+
+    @lru_cache(maxsize=None)
+    def compile(self, name, interval, data_range, reduction='client', distribution=False):
+        """
+        Build the queries for a metric. With reduction='server' the averaging over the range is pushed into PromQL
+        so Prometheus returns one point per series. The ">= 0" drops NaN samples (e.g. 0/0 rates) the same way
+        the client-side reduction skips nulls. Metrics reduced with "max" use max_over_time instead.
+        The metric's "distribution" queries (e.g. latency quantiles) are only included if distribution is True.
+        """
+        metric = self.metrics[name]
+        queries = []
+        for q in metric['queries'] + (metric.get('distribution', []) if distribution else []):
+            expr = Template(q['expr']).substitute(self.selectors)
+            query = Query(ref_id=q['ref'], expr=expr, interval_ms=interval * 1000, interval_factor=q.get('interval_factor', 1), instant=q.get('instant', False))
+            if reduction == 'server':
+                function = SERVER_REDUCTIONS.get(metric['reduce'], 'avg_over_time')
+                query = query._replace(expr=f'{function}((({expr}) >= 0)[{data_range}m:{interval}s])', instant=True, range=False, max_data_points=1)
+            queries.append(query)
+        return tuple(queries)
+
+    def reduce(self, name, results):
+        metric = self.metrics[name]
+        return REDUCTIONS[metric['reduce']](metric, results)
+
+    def reduce_distribution(self, name, results):
+        """
+        Perfdata label -> mean of each of the metric's distribution queries.
+        """
+        metric = self.metrics[name]
+        return {q['perfdata']: round(_series_mean(results[q['ref']], metric), metric['round']) for q in metric.get('distribution', [])}
+
+
+def load_registry(path=None, **selectors):
+    with open(path or DEFAULT_METRICS_FILE) as f:
+        return Registry(json.load(f), **selectors)
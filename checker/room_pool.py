@@ -0,0 +1,58 @@
+import json
+import os
+import time
+
+from .cache import atomic_write, locked
+
+
+class RoomPool:
+    """
+    Long-lived probe rooms tracked in a JSON state file, keyed by e.g. "@bot1:a.com->@bot2:b.com".
+    A room older than `max_age` seconds is no longer handed out, so rooms get rotated and a
+    room that went bad (e.g. a broken federation state) doesn't stick around forever.
+
+    Two checks rotating the same room at the same moment will each create a room and the last
+    one to save wins. The other room is no longer in the pool and gets left by the next cleanup.
+    """
+
+    def __init__(self, path, max_age=24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.rooms = {}
+        if os.path.exists(path):
+            with locked(path + '.lock', shared=True):
+                with open(path) as f:
+                    self.rooms = json.load(f).get('rooms', {})
+
+    def get(self, key):
+        """
+        The room ID for `key`, or None if there is none or it is due for rotation.
+        """
+        room = self.rooms.get(key)
+        if room and time.time() - room['created'] < self.max_age:
+            return room['room_id']
+        return None
+
+    def set(self, key, room_id):
+        self.rooms[key] = {'room_id': room_id, 'created': time.time()}
+        self.save()
+
+    def discard(self, key):
+        if self.rooms.pop(key, None):
+            self.save(removed=[key])
+
+    def room_ids(self):
+        return {room['room_id'] for room in self.rooms.values()}
+
+    def save(self, removed=()):
+        with locked(self.path + '.lock'):
+            # Keep rooms other checks added since we loaded the file.
+            rooms = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    rooms = json.load(f).get('rooms', {})
+            rooms.update(self.rooms)
+            for key in removed:
+                rooms.pop(key, None)
+            self.rooms = rooms
+            atomic_write(self.path, json.dumps({'rooms': self.rooms}, indent=2).encode())
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from .cache import atomic_write, locked
+from .notify import build_digest
+
+# nio is only imported by the functions that send. A notification script that finds the sender running just queues
+# its message with enqueue(), and importing nio would take longer than everything else it does.
+
+
+def enqueue(directory, room, content, notification=None):
+    """
+    Queue the message `content` for `room`. The file is named after the current time so the messages are sent in the order they were queued.
+    `notification` has the build_msg() arguments of a service notification so the sender can merge it into a digest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}.json')
+    atomic_write(path, json.dumps({'room': room, 'content': content, 'notification': notification, 'queued': time.time()}).encode(), fsync=True)
+    return path
+
+
+def queued_at(path):
+    return int(os.path.basename(path).split('-')[0]) / 1e9
+
+
+def pending(directory):
+    """
+    The queued messages, oldest first. Half-written files start with a dot and are skipped.
+    """
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in sorted(names) if name.endswith('.json') and not name.startswith('.')]
+
+
+def sender_running(directory):
+    """
+    matrix-notification-sender.py holds the daemon lock as long as it runs.
+    """
+    try:
+        with locked(os.path.join(directory, '.daemon.lock'), blocking=False):
+            return False
+    except BlockingIOError:
+        return True
+
+
+def set_aside(path):
+    failed = os.path.join(os.path.dirname(path), 'failed')
+    os.makedirs(failed, exist_ok=True)
+    os.replace(path, os.path.join(failed, os.path.basename(path)))
+
+
+def coalesce(messages):
+    """
+    Group the (path, message) pairs into batches that are sent as one message: service notifications of the same type for
+    the same room, host and state are merged, everything else is a batch of its own. The batches are in the order of their first message.
+    """
+    batches = {}
+    for path, message in messages:
+        n = message.get('notification')
+        key = (message['room'], n['host_name'], n['state'], n['type']) if n else path
+        batches.setdefault(key, []).append((path, message))
+    return list(batches.values())
+
+
+def render(batch):
+    from .synapse_client import message_content
+
+    if len(batch) == 1:
+        message = batch[0][1]
+        # Messages queued by older versions are markdown.
+        return message['content'] if 'content' in message else message_content(message['msg'])
+    first = batch[0][1]['notification']
+    return build_digest(first['host_name'], first['host_display_name'], first['state'], [message['notification'] for _, message in batch], first.get('icinga2_url'))
+
+
+async def drain(client, directory, joined, relogin, window=0):
+    """
+    Send every queued message in order, deleting each one only once it was sent. Returns how many queued messages were sent.
+    With a `window` nothing is sent until the oldest message has waited that many seconds, then the queue is
+    coalesced so e.g. 30 services going critical on one host become one message.
+    Must be called with the sender lock held so two senders don't send the same message.
+    """
+    from nio import RoomSendResponse
+
+    from .synapse_client import deliver
+
+    paths = pending(directory)
+    if window and paths and time.time() - queued_at(paths[0]) < window:
+        return 0
+    messages = []
+    for path in paths:
+        try:
+            with open(path) as f:
+                messages.append((path, json.load(f)))
+        except ValueError:
+            print(f'Moving unreadable message {path} to failed/')
+            set_aside(path)
+
+    sent = 0
+    for batch in coalesce(messages) if window else [[x] for x in messages]:
+        resp = await deliver(client, batch[0][1]['room'], render(batch), joined, relogin)
+        for path, _ in batch:
+            if isinstance(resp, RoomSendResponse):
+                os.unlink(path)
+                sent += 1
+            else:
+                print(f'Failed to send {path}, moving it to failed/: {resp}')
+                set_aside(path)
+    return sent
+
+
+def connect(user, pw, hs, auth_file):
+    """
+    A client and a coroutine function that logs it in (again) with the token cache.
+    max_limit_exceeded=0 makes nio hand rate limits back to send() instead of retrying on its own.
+    Timeouts and connection errors are still retried by nio, which blocks the queue until the homeserver is back.
+    """
+    from nio import AsyncClient, AsyncClientConfig
+
+    from . import token_cache
+
+    client = AsyncClient(hs, user, config=AsyncClientConfig(max_limit_exceeded=0))
+
+    async def relogin():
+        return await token_cache.login(client, pw, auth_file)
+
+    return client, relogin
+
+
+def submit(directory, room, content, user, pw, hs, auth_file=None, notification=None):
+    """
+    Queue a notification for matrix-notification-sender.py. If the sender isn't running, send the queue right here
+    so nothing is left behind. Everyone sending takes the sender lock and only deletes what it sent, so no message is sent twice.
+    """
+    enqueue(directory, room, content, notification)
+    if sender_running(directory):
+        return
+
+    from nio import LoginError
+
+    from . import token_cache
+
+    async def inner():
+        client, relogin = connect(user, pw, hs, auth_file)
+        try:
+            resp = await relogin()
+            if isinstance(resp, LoginError):
+                print(f'Failed to log in, the message stays queued: {resp}')
+                return
+            # Keep going until the queue is empty in case more messages were queued while we were sending.
+            joined = token_cache.known_rooms(user, hs)
+            while await drain(client, directory, joined, relogin):
+                pass
+            token_cache.remember_rooms(user, hs, joined)
+        finally:
+            await client.close()
+
+    with locked(os.path.join(directory, '.sender.lock')):
+        asyncio.run(inner())
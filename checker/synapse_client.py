@@ -1,17 +1,11 @@
 import asyncio
-import copy
-import json
 import os
 import sys
-import time
+from typing import NamedTuple
 
-import aiofiles.os
-import magic
-import markdown
-from PIL import Image
-from nio import AsyncClient, LoginResponse, MatrixRoom, RoomForgetResponse, RoomLeaveResponse, RoomSendError, UploadResponse
+from nio import AsyncClient, ErrorResponse, JoinResponse, JoinedRoomsResponse, LoginError, RoomForgetResponse, RoomLeaveResponse, RoomSendError, RoomSendResponse, SyncResponse, UploadResponse
 
-from . import nagios
+from . import nagios, token_cache
 
 
 def handle_err(func):
@@ -30,23 +24,6 @@ def handle_err(func):
     return wrapper
 
 
-def write_login_details_to_disk(resp: LoginResponse, homeserver, config_file) -> None:
-    """Writes the required login details to disk so we can log in later without
-    using a password.
-    Arguments:
-        resp {LoginResponse} -- the successful client login response.
-        homeserver -- URL of homeserver, e.g. "https://matrix.example.org"
-    """
-    # open the config file in write-mode
-    with open(config_file, "w") as f:
-        # write the login details to disk
-        json.dump({"homeserver": homeserver,  # e.g. "https://matrix.example.org"
-                   "user_id": resp.user_id,  # e.g. "@user:example.org"
-                   "device_id": resp.device_id,  # device ID, 10 uppercase letters
-                   "access_token": resp.access_token,  # cryptogr. access token
-                   }, f, )
-
-
 async def send_image(client, room_id, image):
     """Send image to room.
     Arguments:
@@ -74,6 +51,11 @@ async def send_image(client, room_id, image):
             "url": "mxc://example.com/SomeStrangeUriKey"
         }
     """
+    # Only needed for images so they aren't imported for every text message.
+    import aiofiles.os
+    import magic
+    from PIL import Image
+
     mime_type = magic.from_file(image, mime=True)  # e.g. "image/jpeg"
     if not mime_type.startswith("image/"):
         print(f'UNKNOWN: wrong mime type "{mime_type}"')
@@ -106,9 +88,21 @@ async def send_image(client, room_id, image):
         sys.exit(nagios.UNKNOWN)
 
 
+def message_content(msg):
+    """
+    Message content for a markdown `msg`. The notifications are rendered by checker.notify.build_content() instead,
+    markdown is only needed for this and is optional. Without it the message is sent as plain text.
+    """
+    try:
+        import markdown
+    except ImportError:
+        return {"msgtype": "m.text", "body": msg}
+    return {"msgtype": "m.text", "body": msg, "format": "org.matrix.custom.html", "formatted_body": markdown.markdown(msg), }
+
+
 def send_msg(client, room, msg):
     async def inner(client, room, msg):
-        r = await client.room_send(room_id=room, message_type="m.room.message", content={"msgtype": "m.text", "body": msg, "format": "org.matrix.custom.html", "formatted_body": markdown.markdown(msg), }, )
+        r = await client.room_send(room_id=room, message_type="m.room.message", content=message_content(msg))
         if isinstance(r, RoomSendError):
             print(r)
         await client.close()
@@ -116,28 +110,108 @@ def send_msg(client, room, msg):
     return asyncio.run(inner(client, room, msg))
 
 
+# Sending to the room again won't help.
+SEND_PERMANENT_ERRORS = ('M_FORBIDDEN', 'M_NOT_FOUND', 'M_BAD_JSON', 'M_NOT_JSON', 'M_TOO_LARGE', 'M_INVALID_PARAM')
+
+# Logging in with the password again won't help, e.g. it was changed or the account was deactivated.
+LOGIN_PERMANENT_ERRORS = ('M_FORBIDDEN', 'M_USER_DEACTIVATED', 'M_INVALID_USERNAME', 'M_BAD_JSON', 'M_INVALID_PARAM')
+
+
+async def deliver(client, room, content, joined, relogin, deadline=None):
+    """
+    Send a message, retrying until it is sent or fails for good. Waits as long as the server asks when we are rate limited,
+    joins the room if it isn't in `joined` (or the server says we aren't in it) and logs in again if the token stopped working.
+    Rooms it joins are added to `joined`. Returns the RoomSendResponse, or the error that made us give up, which is the LoginError
+    if logging in again failed for good. With a `deadline` (loop time) it also gives up once that has passed, without one it never does.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def bounded(coro):
+        if deadline is None:
+            return await coro
+        return await asyncio.wait_for(coro, max(deadline - loop.time(), 0))
+
+    delay = 1
+    tried_join = False
+    while True:
+        try:
+            if room not in joined:
+                tried_join = True
+                resp = await bounded(client.join(room))
+                if isinstance(resp, JoinResponse):
+                    joined.add(room)
+            if room in joined:
+                resp = await bounded(client.room_send(room, 'm.room.message', content))
+        except Exception as e:
+            # A timeout has an empty message
+            resp = ErrorResponse(str(e) or type(e).__name__)
+        if isinstance(resp, RoomSendResponse):
+            return resp
+        if resp.retry_after_ms or resp.status_code == 'M_LIMIT_EXCEEDED':
+            wait = (resp.retry_after_ms or delay * 1000) / 1000
+        elif resp.status_code == 'M_FORBIDDEN' and not tried_join:
+            # We remembered being in the room but were kicked or left since.
+            joined.discard(room)
+            continue
+        else:
+            if resp.status_code in ('M_UNKNOWN_TOKEN', 'M_MISSING_TOKEN'):
+                try:
+                    login = await bounded(relogin())
+                except Exception as e:
+                    login = ErrorResponse(str(e) or type(e).__name__)
+                if isinstance(login, LoginError) and login.status_code in LOGIN_PERMANENT_ERRORS:
+                    return login
+            elif resp.status_code in SEND_PERMANENT_ERRORS:
+                return resp
+            # The homeserver is down or unreachable, try again.
+            wait = delay
+            delay = min(delay * 2, 60)
+        if deadline is not None and loop.time() + wait >= deadline:
+            return resp
+        await asyncio.sleep(wait)
+
+
+def notify(user, pw, hs, auth_file, room, content, timeout=45):
+    """
+    Log in, send the message `content` (see checker.notify.build_content()) to `room` and close, all in one event loop on one connection.
+    The bot only joins the room if it doesn't remember being in it already.
+    Only a failed password login gives up. If checking the cached token failed for another reason (e.g. the homeserver
+    answered with a 502) the token is used anyway and deliver() retries, or logs in again if the token turns out to be bad.
+    Gives up after `timeout` seconds, before Icinga2 kills the notification (60 seconds by default). Use --spool for
+    notifications that have to survive a homeserver that is down for longer.
+    """
+    async def inner():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        client = AsyncClient(hs, user)
+        try:
+            try:
+                resp = await asyncio.wait_for(token_cache.login(client, pw, auth_file), timeout)
+            except asyncio.TimeoutError:
+                resp = LoginError(f'no answer within {timeout} seconds')
+            if isinstance(resp, LoginError):
+                print(f'Failed to log in "{resp}"')
+                return resp
+            joined = token_cache.known_rooms(user, hs)
+            before = set(joined)
+            r = await deliver(client, room, content, joined, lambda: token_cache.login(client, pw, auth_file), deadline)
+            if not isinstance(r, RoomSendResponse):
+                print(r)
+            if joined != before:
+                token_cache.remember_rooms(user, hs, joined)
+            return r
+        finally:
+            await client.close()
+
+    return asyncio.run(inner())
+
+
 def login(user, pw, hs, auth_file, room):
     async def inner(user, pw, hs, auth_file, room):
         client = AsyncClient(hs, user)
-        if auth_file:
-            # If there are no previously-saved credentials, we'll use the password
-            if not os.path.exists(auth_file):
-                resp = await client.login(pw)
-                # check that we logged in successfully
-                if isinstance(resp, LoginResponse):
-                    write_login_details_to_disk(resp, hs, auth_file)
-                else:
-                    print(f'Failed to log in "{resp}"')
-            else:
-                # Otherwise the config file exists, so we'll use the stored credentials
-                with open(auth_file, "r") as f:
-                    config = json.load(f)
-                    client = AsyncClient(config["homeserver"])
-                    client.access_token = config["access_token"]
-                    client.user_id = config["user_id"]
-                    client.device_id = config["device_id"]
-        else:
-            await client.login(pw)
+        resp = await token_cache.login(client, pw, auth_file)
+        if isinstance(resp, LoginError):
+            print(f'Failed to log in "{resp}"')
 
         await client.join(room)
         x = client.access_token
@@ -147,30 +221,77 @@ def login(user, pw, hs, auth_file, room):
     return asyncio.run(inner(user, pw, hs, auth_file, room))
 
 
+class LeaveResult(NamedTuple):
+    """
+    Outcome of leaving and forgetting a room. Indexes like the (ok, leave response, forget response) tuple it replaces.
+    """
+    ok: bool
+    leave: object
+    forget: object
+    room_id: str = None
+
+
+# Retrying these won't help.
+PERMANENT_ERRORS = ('M_FORBIDDEN', 'M_NOT_FOUND', 'M_UNKNOWN_TOKEN', 'M_MISSING_TOKEN')
+
+# Just the invites, leave_all_rooms_async() gets the joined rooms from /joined_rooms.
+INVITES_FILTER = {
+    'room': {
+        'timeline': {'limit': 0},
+        'state': {'types': []},
+        'ephemeral': {'not_types': ['*']},
+        'account_data': {'not_types': ['*']},
+    },
+    'presence': {'not_types': ['*']},
+    'account_data': {'not_types': ['*']},
+}
+
+
+async def _retry(request, *args, attempts=4):
+    """
+    Call request(*args) until it doesn't return an error, waiting as long as the server asks us to when we are rate limited
+    and backing off otherwise. Never blocks the event loop.
+    """
+    delay = 0.5
+    for attempt in range(attempts):
+        resp = await request(*args)
+        if not isinstance(resp, ErrorResponse) or resp.status_code in PERMANENT_ERRORS or attempt == attempts - 1:
+            return resp
+        await asyncio.sleep(resp.retry_after_ms / 1000 if resp.retry_after_ms else delay)
+        delay *= 2
+
+
 async def leave_room_async(room_id, client):
-    l = await client.room_leave(room_id)
-    time.sleep(1)
-    f = await client.room_forget(room_id)
-    return isinstance(l, RoomLeaveResponse) and isinstance(f, RoomForgetResponse), l, f
-
-
-async def leave_all_rooms_async(client, exclude_starting_with=None):
-    results = []
-    for room_id in (await client.joined_rooms()).rooms:
-        room = MatrixRoom(room_id, client.user_id)
-        # if exclude_starting_with and room.named_room_name() is not None and room.named_room_name().startswith(exclude_starting_with):
-        #     continue
-        s, l, f = await leave_room_async(room_id, client)
-        results.append((s, l, f))
-        time.sleep(1)
-    await client.sync()
-    invited_rooms = copy.copy(client.invited_rooms)  # RuntimeError: dictionary changed size during iteration
-    for name, room in invited_rooms.items():
-        # if exclude_starting_with and room.named_room_name() is not None and room.named_room_name().startswith(exclude_starting_with):
-        #     continue
-        s, l, f = await leave_room_async(room.room_id, client)
-        results.append((s, l, f))
-        time.sleep(1)
+    l = await _retry(client.room_leave, room_id)
+    f = await _retry(client.room_forget, room_id)
+    return LeaveResult(isinstance(l, RoomLeaveResponse) and isinstance(f, RoomForgetResponse), l, f, room_id)
+
+
+async def leave_rooms_async(client, room_ids, concurrency=5):
+    """
+    Leave and forget `room_ids`, at most `concurrency` at a time. Returns a LeaveResult per room.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def leave(room_id):
+        async with semaphore:
+            return await leave_room_async(room_id, client)
+
+    return await asyncio.gather(*(leave(room_id) for room_id in room_ids))
+
+
+async def leave_all_rooms_async(client, exclude_starting_with=None, concurrency=5):
+    """
+    Leave and forget every room the client is in or invited to. Returns a LeaveResult per room.
+    exclude_starting_with isn't supported yet since room names aren't known without syncing each room's state.
+    """
+    # Sync from scratch, an incremental sync only has invites that are new since the last one.
+    client.next_batch = None
+    joined, sync = await asyncio.gather(client.joined_rooms(), client.sync(sync_filter=INVITES_FILTER))
+    room_ids = list(joined.rooms) if isinstance(joined, JoinedRoomsResponse) else []
+    if isinstance(sync, SyncResponse):
+        room_ids += [room_id for room_id in sync.rooms.invite if room_id not in room_ids]
+    results = await leave_rooms_async(client, room_ids, concurrency)
     await client.close()
     return results
 
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+import os
+from contextlib import ExitStack
+
+from nio import LoginResponse, WhoamiError, WhoamiResponse
+
+from .cache import atomic_write, locked
+
+DEFAULT_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'icinga2-checks', 'tokens')
+
+
+def token_path(user, homeserver, directory=DEFAULT_DIR):
+    """
+    Where the login details of `user` on `homeserver` are cached if no auth file is given.
+    Returns None if the directory can't be created, then every run logs in with the password.
+    """
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    except OSError:
+        return None
+    return os.path.join(directory, hashlib.sha256(f'{user}|{homeserver}'.encode()).hexdigest()[:32] + '.json')
+
+
+def read_details(path, user, homeserver):
+    """
+    The cached login details, or None if there are none or they are for another user or homeserver.
+    The file is the same format the auth files have always been, so existing ones keep working.
+    """
+    try:
+        with open(path) as f:
+            details = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if details.get('homeserver') != homeserver or (user.startswith('@') and details.get('user_id') != user):
+        return None
+    return details
+
+
+def write_details(path, resp: LoginResponse, homeserver):
+    # atomic_write() creates the file with mode 600, only the checks' user can read the token.
+    atomic_write(path, json.dumps({'homeserver': homeserver, 'user_id': resp.user_id, 'device_id': resp.device_id, 'access_token': resp.access_token}).encode())
+
+
+def use_details(client, details):
+    client.access_token = details['access_token']
+    client.user_id = details['user_id']
+    client.device_id = details['device_id']
+
+
+def rooms_path(user, homeserver):
+    path = token_path(user, homeserver)
+    return path and path[:-len('.json')] + '.rooms.json'
+
+
+def known_rooms(user, homeserver):
+    """
+    The rooms the bot remembers joining, so it doesn't have to join them again every run.
+    """
+    path = rooms_path(user, homeserver)
+    try:
+        with open(path) as f:
+            return set(json.load(f))
+    except (TypeError, OSError, ValueError):
+        return set()
+
+
+def remember_rooms(user, homeserver, rooms):
+    path = rooms_path(user, homeserver)
+    if path:
+        atomic_write(path, json.dumps(sorted(rooms)).encode())
+
+
+async def login(client, password, auth_file=None):
+    """
+    Log `client` in with a cached access token if it still works, otherwise with the password.
+    The token is checked with /whoami and only replaced when the server says it is unknown, so a homeserver
+    that is down doesn't cause a password login (and a new device) per run. Checks running at the same time
+    share the file and only one of them logs in, the others wait for it and use its token.
+    Returns the WhoamiResponse or LoginResponse, or the error.
+    """
+    homeserver, user = client.homeserver, client.user
+    path = auth_file or token_path(user, homeserver)
+    if path is None:
+        return await client.login(password)
+
+    rejected = None
+    details = read_details(path, user, homeserver)
+    if details:
+        use_details(client, details)
+        resp = await client.whoami()
+        if not isinstance(resp, WhoamiError) or resp.status_code != 'M_UNKNOWN_TOKEN':
+            return resp
+        rejected = details['access_token']
+
+    loop = asyncio.get_running_loop()
+    with ExitStack() as stack:
+        # flock() blocks, wait for it in a thread so the other bots of this check keep going.
+        await loop.run_in_executor(None, stack.enter_context, locked(path + '.lock'))
+        details = read_details(path, user, homeserver)
+        if details and details['access_token'] != rejected:
+            # Another check logged in while we were waiting for the lock.
+            use_details(client, details)
+            return WhoamiResponse(details['user_id'], details['device_id'], False)
+        # Keeps the device ID of the old token (if there was one) so the bot doesn't collect a new device per login.
+        resp = await client.login(password)
+        if isinstance(resp, LoginResponse):
+            write_details(path, resp, homeserver)
+        return resp
@@ -1,6 +1,7 @@
 import json
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 import urllib3
@@ -8,10 +9,17 @@ from flask import Flask, Response, request
 from icinga2api.client import Client
 
 from checker import nagios
+from checker.cache import FileCache
+from checker.icinga_index import StateIndex
 
 endpoint = 'https://localhost:8080'  # Icinga2 URL for the API. Defaults to "https://localhost:8080"
 icinga2_user = 'icingaweb2'  # API username. Defaults to "icingaweb2"
 icinga2_pw = ''  # API password or set ICINGA2KUMA_ICINGA2_PW
+cache_dir = os.environ.get('ICINGA2KUMA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'icinga2kuma-cache'))  # Shared by all the workers
+cache_ttl = float(os.environ.get('ICINGA2KUMA_CACHE_TTL', 10))  # Seconds to reuse Icinga2's answer for a host. 0 disables the cache
+use_events = os.environ.get('ICINGA2KUMA_EVENTS', 'true') == 'true'  # Answer from an index kept up to date by Icinga2's event stream
+resync_interval = float(os.environ.get('ICINGA2KUMA_RESYNC', 300))  # Seconds between full reloads of the index
+stream_timeout = float(os.environ.get('ICINGA2KUMA_STREAM_TIMEOUT', 120))  # Reconnect the event stream if nothing arrives for this long
 
 if (icinga2_pw == '' or not icinga2_pw) and os.environ.get('ICINGA2KUMA_ICINGA2_PW'):
     icinga2_pw = os.environ.get('ICINGA2KUMA_ICINGA2_PW')
@@ -22,10 +30,26 @@ else:
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 client = Client(endpoint, icinga2_user, icinga2_pw)
+cache = FileCache(cache_dir, cache_ttl) if cache_ttl > 0 else None
+index = StateIndex(client, resync_interval, stream_timeout) if use_events else None
 
 app = Flask(__name__)
 
 
+def list_objects(object_type, hostid):
+    """
+    client.objects.list() for the Host or Services of `hostid`. The result is shared between the gunicorn workers for cache_ttl seconds
+    and concurrent polls for the same host wait for the first one to get it instead of all asking Icinga2.
+    """
+    if cache is None:
+        return client.objects.list(object_type, filters='match(hpattern, host.name)', filter_vars={'hpattern': hostid})
+
+    def fetch():
+        return json.dumps(client.objects.list(object_type, filters='match(hpattern, host.name)', filter_vars={'hpattern': hostid})).encode()
+
+    return json.loads(cache.get(cache.make_key('icinga2kuma', object_type, hostid), fetch))
+
+
 @app.route('/host')
 @app.route('/host/')
 @app.route("/host/<hostid>")
@@ -47,7 +71,18 @@ def get_host_state(hostid=None):
         'ignored_services': [],
     }
 
-    host_status = client.objects.list('Host', filters='match(hpattern, host.name)', filter_vars={'hpattern': hostid})
+    if index:
+        index.start()
+    host_status = services_status = None
+    if index and index.ready():
+        host_status, services_status = index.lookup(hostid)
+        if not len(host_status) or any(service not in {obj['name'].split('!')[1] for obj in services_status} for service in args_service):
+            # Added since the last resync, ask Icinga2 instead of reporting it missing.
+            host_status = services_status = None
+    if host_status is None:
+        # The index isn't filled yet, the event stream is down or the index doesn't know the host.
+        host_status = list_objects('Host', hostid)
+
     if not len(host_status):
         return Response(json.dumps({'error': 'could not find host'}), status=404, mimetype='application/json')
     else:
@@ -62,7 +97,8 @@ def get_host_state(hostid=None):
         }
     }
 
-    services_status = client.objects.list('Service', filters='match(hpattern, host.name)', filter_vars={'hpattern': hostid})
+    if services_status is None:
+        services_status = list_objects('Service', hostid)
     for attrs in services_status:
         name = attrs['name'].split('!')[1]
         if name in args_exclude_service:
@@ -1,14 +1,15 @@
 import argparse
 
-import checker.synapse_client as synapse_client
-from checker.notify import build_msg
+from checker import spool
+from checker.notify import build_content
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('--user', required=True, help='User ID for the bot.')
 parser.add_argument('--pw', required=True, help='Password for the bot.')
 parser.add_argument('--hs', required=True, help='Homeserver of the bot.')
 parser.add_argument('--room', required=True, help='The room the bot should send its messages in.')
-parser.add_argument('--auth-file', help="File to cache the bot's login details to.")
+parser.add_argument('--auth-file', help="File to cache the bot's login details to. Defaults to a file in ~/.cache/icinga2-checks/tokens.")
+parser.add_argument('--spool', help="Queue the message in this directory for matrix-notification-sender.py. If the sender isn't running the queue is sent right away.")
 
 parser.add_argument('--longdatetime', required=True, help='$icinga.long_date_time$')
 parser.add_argument('--hostname', required=True, help='$host.name$')
@@ -25,7 +26,7 @@ parser.add_argument('--icinga2weburl', required=False, help='$notification.icing
 args = parser.parse_args()
 
 if __name__ == '__main__':
-    msg = build_msg(
+    content = build_content(
         host_name=args.hostname,
         host_display_name=args.hostdisplayname,
         state=args.hoststate,
@@ -36,5 +37,10 @@ if __name__ == '__main__':
         author=args.notificationauthor,
         icinga2_url=args.icinga2weburl
     )
-    access_token, client = synapse_client.login(args.user, args.pw, args.hs, args.auth_file, args.room)
-    synapse_client.send_msg(client, args.room, msg)
+    if args.spool:
+        spool.submit(args.spool, args.room, content, args.user, args.pw, args.hs, args.auth_file)
+    else:
+        # Imported here so queueing with --spool doesn't pay for importing nio.
+        import checker.synapse_client as synapse_client
+
+        synapse_client.notify(args.user, args.pw, args.hs, args.auth_file, args.room, content)
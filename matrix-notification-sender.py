@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import os
+import signal
+import sys
+from contextlib import ExitStack
+
+from nio import ErrorResponse
+
+from checker import spool, token_cache
+from checker.cache import locked
+
+parser = argparse.ArgumentParser(description='Send the notifications queued by the notification scripts with --spool, using one login and connection.')
+parser.add_argument('--user', required=True, help='User ID for the bot.')
+parser.add_argument('--pw', required=True, help='Password for the bot.')
+parser.add_argument('--hs', required=True, help='Homeserver of the bot.')
+parser.add_argument('--auth-file', help="File to cache the bot's login details to. Defaults to a file in ~/.cache/icinga2-checks/tokens.")
+parser.add_argument('--spool', required=True, help='Directory the notification scripts queue their messages in.')
+parser.add_argument('--interval', type=float, default=0.5, help='Seconds between looking for new messages.')
+parser.add_argument('--window', type=float, default=0, help='Hold messages for this many seconds and merge the service notifications for the same host and state into one message. Disabled by default.')
+args = parser.parse_args()
+
+
+async def run():
+    client, relogin = spool.connect(args.user, args.pw, args.hs, args.auth_file)
+    delay = 1
+    while True:
+        try:
+            resp = await relogin()
+        except Exception as e:
+            resp = ErrorResponse(str(e))
+        if not isinstance(resp, ErrorResponse):
+            break
+        print(f'Failed to log in, retrying in {delay} seconds: {resp}')
+        sys.stdout.flush()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
+    print(f'Logged in as {client.user_id}, sending messages queued in {args.spool}')
+    sys.stdout.flush()
+
+    joined = token_cache.known_rooms(args.user, args.hs)
+    while True:
+        # A notification script that found the sender not running may be sending the queue itself, wait for it.
+        with locked(os.path.join(args.spool, '.sender.lock')):
+            sent = await spool.drain(client, args.spool, joined, relogin, args.window)
+        if sent:
+            print(f'Sent {sent} queued messages')
+            sys.stdout.flush()
+        else:
+            await asyncio.sleep(args.interval)
+
+
+def main():
+    # Turn SIGTERM into SystemExit so a message that is being sent isn't cut off halfway. It stays queued until it was sent.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    os.makedirs(args.spool, exist_ok=True)
+    with ExitStack() as stack:
+        try:
+            stack.enter_context(locked(os.path.join(args.spool, '.daemon.lock'), blocking=False))
+        except BlockingIOError:
+            print(f'Another sender is already running for {args.spool}')
+            sys.exit(1)
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()